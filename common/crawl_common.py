@@ -0,0 +1,1250 @@
+"""
+Crawl infrastructure shared by the scrapers: the Chrome driver pool and
+page-settle waits, the HTTP and async fetchers, the crawl journal, the
+streaming pipeline and the batched product_db / variant_db writer.
+
+The scrapers import it after loading their local.env, the settings below
+are read from the environment when it is imported.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import sqlite3
+import hashlib
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from collections import ChainMap
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.parse import urlparse
+from typing import Any, Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from selenium import webdriver
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, WebDriverException
+from selenium.common.exceptions import StaleElementReferenceException
+from playwright.async_api import async_playwright, Error as PlaywrightError
+import psycopg2
+from psycopg2 import sql, extras
+
+# Number of headless Chrome drivers working on product pages in parallel
+DRIVER_WORKERS = int(os.getenv("DRIVER_WORKERS", os.cpu_count() or 1))
+
+# Pooled drivers are restarted after this many pages, or once Chrome's processes
+# use more than this much memory (MB); 0 turns the check off
+DRIVER_MAX_PAGES = int(os.getenv("DRIVER_MAX_PAGES", 200))
+DRIVER_MAX_RSS_MB = int(os.getenv("DRIVER_MAX_RSS_MB", 1500))
+
+# Pipeline stages: fetch threads (HTTP, Chrome through the driver pool), parse
+# worker processes, and how many items may wait in the queue between two stages
+FETCH_WORKERS = int(os.getenv("FETCH_WORKERS", 16))
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", os.cpu_count() or 1))
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", 64))
+
+# Parse product and variant pages in the PARSE_WORKERS processes in the pool and
+# async modes too, instead of on the thread driving the browser
+PARSE_PROCESSES = os.getenv("PARSE_PROCESSES", "0") == "1"
+
+# Incremental crawl: send the ETag/Last-Modified stored in the journal as a
+# conditional request and skip products whose extracted fields did not change
+INCREMENTAL = os.getenv("INCREMENTAL", "0") == "1"
+
+# Async crawler limits: total in-flight requests, in-flight requests per host
+# and requests per second per host (token bucket)
+ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", 256))
+HOST_CONCURRENCY = int(os.getenv("HOST_CONCURRENCY", 32))
+HOST_RATE = float(os.getenv("HOST_RATE", 20))
+
+# Selenium waits poll the page every WAIT_POLL seconds for up to WAIT_TIMEOUT;
+# the DOM/network count as settled after SETTLE_TIME seconds without activity
+WAIT_TIMEOUT = float(os.getenv("WAIT_TIMEOUT", 10))
+WAIT_POLL = float(os.getenv("WAIT_POLL", 0.1))
+SETTLE_TIME = float(os.getenv("SETTLE_TIME", 0.5))
+
+# Resource groups Chrome never downloads (image, media, font, analytics), we only read the DOM
+BLOCK_RESOURCES = [group.strip() for group in os.getenv("BLOCK_RESOURCES", "image,media,font,analytics").split(',') if group.strip()]
+
+# HTTP disk cache kept between runs, one directory per driver slot
+CHROME_CACHE_DIR = '../data/chrome_cache'
+CHROME_CACHE_SIZE = int(os.getenv("CHROME_CACHE_SIZE", 256 * 1024 * 1024))
+
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Referer": "https://google.com",
+    "DNT": "0"
+}
+
+PRODUCT_TABLE = 'product_db'
+VARIANT_LOOKUP_TABLE = 'variant_db'
+
+# Parsed products are buffered and written to the DB in batches of this size
+DB_BATCH_SIZE = int(os.getenv("DB_BATCH_SIZE", 500))
+
+def prepare_data_for_sql(value: Any) -> Optional[Union[str, int, float, bool]]:
+    """
+    Standardizes Python values for safe insertion into PostgreSQL via psycopg2.
+    1. Converts sets and lists (of primitives) to comma-separated strings.
+    2. Converts empty strings ("") to None (SQL NULL).
+    3. Returns None for None.
+    """
+    if value is None:
+        return None
+    
+    # 1. Handle collections (sets and lists) by converting them to strings
+    if isinstance(value, (set, list)):
+        # Join list/set items into a comma-separated string
+        try:
+            # Use map(str, value) to ensure all items are strings before joining
+            return ", ".join(map(str, value))
+        except Exception as e:
+            # Fallback if the collection contains complex, unjoinable objects
+            print(f"Warning: Could not stringify collection {value}. Error: {e}. Sending NULL.")
+            return None
+
+    # 2. Handle empty strings (crucial for numeric fields like price)
+    if isinstance(value, str) and value.strip() == "":
+        return None # Translates to SQL NULL
+    
+    # 3. Handle other types (int, float, bool, non-empty str, etc.)
+    return value
+
+# product_db columns and the product_data keys they are filled from
+PRODUCT_FIELDS = {
+    'cat': 'cat', 'url': 'url', 'cat_name': 'cat_name', 'title': 'Title', 'sku': 'Variant SKU',
+    'image_url': 'Image Src', 'descr': 'Body (HTML)', 'cert': 'cert', 'opt_1': 'Option1 name',
+    'opt_2': 'Option2 name', 'opt_3': 'Option3 name', 'tags': 'tags', 'product_category': 'product_category',
+    'type': 'type', 'vendor': 'Vendor', 'inventory_tracker': 'inventory_tracker',
+    'inventory_quantity': 'inventory_quantity', 'debug_1': 'debug_1', 'debug_2': 'debug_2',
+    'debug_3': 'debug_3', 'handle': 'Handle', 'status': 'Status'
+}
+
+# variant_db columns and the variant keys they are filled from
+VARIANT_FIELDS = {
+    'handle': 'Handle', 'var_image_url': 'Image Src', 'opt_1_val': 'Option1 value',
+    'opt_2_val': 'Option2 value', 'opt_3_val': 'Option3 value', 'price': 'Variant Price', 'cost': 'cost',
+    'compare': 'Variant Compare At Price', 'upc': 'Variant Barcode', 'weight': 'weight',
+    'weight_grams': 'weight_grams', 'published': 'published', 'debug_1': 'debug_1', 'debug_2': 'debug_2',
+    'debug_3': 'debug_3', 'vendor': 'Vendor'
+}
+
+PRODUCT_COLUMNS = ['product_id', *PRODUCT_FIELDS, 'status_int']
+VARIANT_COLUMNS = ['var_id', 'product_id', 'sku', *VARIANT_FIELDS, 'status_int']
+
+# Columns refreshed when a variant already exists (var_id conflict)
+VARIANT_UPDATE_COLUMNS = [
+    'var_image_url', 'price', 'cost', 'compare', 'upc', 'weight', 'published',
+    'status_int', 'debug_1', 'debug_2', 'debug_3', 'vendor'
+]
+
+def build_upsert_query(table, columns, conflict_column, update_columns):
+    return sql.SQL("""
+        INSERT INTO {} ({}) VALUES %s
+        ON CONFLICT ({}) DO UPDATE SET {}
+    """).format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.Identifier(conflict_column),
+        sql.SQL(', ').join(
+            sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(col), sql.Identifier(col))
+            for col in update_columns
+        )
+    )
+
+# Multi-variant products have no product-level SKU, keep the stored one on update
+PRODUCT_UPSERT_QUERY = sql.SQL("{}, sku = COALESCE(EXCLUDED.sku, {}.sku)").format(
+    build_upsert_query(
+        PRODUCT_TABLE, PRODUCT_COLUMNS, 'product_id',
+        [col for col in PRODUCT_COLUMNS if col not in ('product_id', 'sku')]
+    ),
+    sql.Identifier(PRODUCT_TABLE)
+)
+VARIANT_UPSERT_QUERY = build_upsert_query(
+    VARIANT_LOOKUP_TABLE, VARIANT_COLUMNS, 'var_id', VARIANT_UPDATE_COLUMNS
+)
+
+# Status of the variants of a product an incremental crawl found unchanged.
+# A live one (EXIST) becomes UNCHANGED, which the export neither re-exports
+# nor drafts; a drafted one (NOT_READY) is back on the site and goes out as
+# UPD, as a full crawl would have written it. UPD/NEW are not exported yet.
+UNCHANGED_STATUS = 'UNCHANGED'
+UNCHANGED_TRANSITIONS = {'EXIST': UNCHANGED_STATUS, 'NOT_READY': 'UPD'}
+
+class ProductWriter:
+    """
+    Buffers parsed products and writes them in batches: one lookup per
+    table, one multi-row INSERT ... ON CONFLICT per table and a single
+    commit per batch, instead of ~4 statements and a commit per product.
+
+    status_int rules are unchanged: a single-variant product whose SKU is
+    already in product_db, or a multi-variant product with any var_id
+    already in variant_db, is 'UPD' (product and variants); anything else
+    is inserted as 'NEW'. The SKU / var_id -> product_id maps for the
+    vendor are loaded once up front and kept current as ids are assigned,
+    so deciding NEW vs UPD needs no per-batch lookup queries.
+
+    Products an incremental crawl found unchanged are not written again,
+    add_unchanged() queues them and their variants get their status from
+    UNCHANGED_TRANSITIONS in the same batch transaction.
+
+    vendor_column / vendor_value mark the scraper's own rows in product_db.
+    """
+
+    def __init__(self, conn, vendor_column, vendor_value, batch_size=DB_BATCH_SIZE):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.vendor_column = vendor_column
+        self.vendor_value = vendor_value
+        self.batch_size = batch_size
+        self.pending = []
+        self.unchanged = []
+        self.ids_by_sku = self.load_index(PRODUCT_TABLE, 'sku')
+        self.ids_by_var_id = self.load_variant_index()
+        print(f"Loaded {len(self.ids_by_sku)} product SKUs and {len(self.ids_by_var_id)} variant ids")
+
+    def add(self, element, product_data, variants):
+        """
+        Queues a product of a crawl element with its variants ([] for
+        single-variant products). Returns the (element, db_status, product_id)
+        results of the products written if the batch got full, otherwise [].
+        """
+        target_sku = variants[0].get("Variant SKU") if variants else product_data.get("Variant SKU")
+        if not target_sku:
+            print(f"Error: Product {element['url']} is missing 'Variant SKU'. Skipping.")
+            return [(element, None, None)]
+
+        self.pending.append((element, product_data, variants))
+        if len(self.pending) + len(self.unchanged) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def add_unchanged(self, element):
+        """
+        Queues the product of a crawl element found unchanged since it was
+        last written. Its results come back with db_status UNCHANGED.
+        """
+        self.unchanged.append(element)
+        if len(self.pending) + len(self.unchanged) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def close(self):
+        results = self.flush()
+        self.cursor.close()
+        return results
+
+    def load_index(self, table, column):
+        query = sql.SQL("SELECT {}, product_id FROM {} WHERE {} = %s AND {} IS NOT NULL").format(
+            sql.Identifier(column), sql.Identifier(table), sql.Identifier(self.vendor_column), sql.Identifier(column)
+        )
+        self.cursor.execute(query, (self.vendor_value,))
+        return dict(self.cursor.fetchall())
+
+    def load_variant_index(self):
+        # Variant rows are scoped through their parent product: the vendor
+        # column of variant_db is not reliably the scraper's own
+        query = sql.SQL(
+            "SELECT v.var_id, v.product_id FROM {} v JOIN {} p ON p.product_id = v.product_id "
+            "WHERE p.{} = %s AND v.var_id IS NOT NULL"
+        ).format(sql.Identifier(VARIANT_LOOKUP_TABLE), sql.Identifier(PRODUCT_TABLE), sql.Identifier(self.vendor_column))
+        self.cursor.execute(query, (self.vendor_value,))
+        return dict(self.cursor.fetchall())
+
+    def allocate_product_ids(self, count):
+        if not count:
+            return []
+        self.cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'product_id')) FROM generate_series(1, %s)",
+            (PRODUCT_TABLE, count)
+        )
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def single_variant_row(self, product_data):
+        """(var_id, variant dict) of a product without variants: the product row itself with its first image."""
+        variant = dict(product_data)
+        image_urls = list(product_data.get('Image Src', []))
+        variant['Image Src'] = image_urls[0] if image_urls else ""
+        return product_data.get("Variant SKU"), variant
+
+    def variant_rows(self, product_data, variants):
+        """Returns (var_id, variant dict) pairs written for a product."""
+        if not variants:
+            return [self.single_variant_row(product_data)]
+
+        rows = []
+        for variant in variants:
+            var_sku = variant.get("Variant SKU")
+            if not var_sku:
+                print(f"Warning: Variant is missing SKU. Skipping.")
+                continue
+            rows.append((var_sku, variant))
+        return rows
+
+    def flush(self):
+        """
+        Writes all buffered products in one transaction. If the batch fails,
+        it is rolled back and its products are reported as skipped
+        (db_status None), so the crawl goes on with the next batch.
+        """
+        if not self.pending and not self.unchanged:
+            return []
+        batch, self.pending = self.pending, []
+        unchanged, self.unchanged = self.unchanged, []
+        batch = [(element, product_data, self.variant_rows(product_data, variants), variants)
+                 for element, product_data, variants in batch]
+
+        # Ids assigned in this batch are staged on top of the index and only
+        # merged into it once the batch is committed
+        ids_by_sku = ChainMap({}, self.ids_by_sku)
+        ids_by_var_id = ChainMap({}, self.ids_by_var_id)
+
+        # Resolve NEW / UPD in crawl order. A product seen earlier (in this or
+        # a previous batch) counts as stored, exactly as with a commit per product.
+        resolved = []
+        new_count = 0
+        for element, product_data, rows, variants in batch:
+            if variants:
+                product_id = next((ids_by_var_id[var_id] for var_id, _ in rows if var_id in ids_by_var_id), None)
+            else:
+                product_id = ids_by_sku.get(rows[0][0])
+
+            if product_id is None:
+                db_status = 'NEW'
+                product_id = ('new', new_count)
+                new_count += 1
+            else:
+                db_status = 'UPD'
+
+            if not variants:
+                ids_by_sku[rows[0][0]] = product_id
+            for var_id, _ in rows:
+                ids_by_var_id[var_id] = product_id
+            resolved.append((element, product_data, rows, db_status, product_id))
+
+        try:
+            new_ids = self.allocate_product_ids(new_count)
+            results = self.write(resolved, new_ids) if resolved else []
+            self.mark_unchanged(unchanged)
+            self.conn.commit()
+        except psycopg2.Error as e:
+            self.conn.rollback()
+            print(f"Database error, skipping a batch of {len(batch) + len(unchanged)} products: {e}", file=sys.stderr)
+            return [(element, None, None) for element, *_ in batch] + [(element, None, None) for element in unchanged]
+
+        # Swap the placeholders for the reserved ids and apply the staged index
+        for _, _, rows, _, product_id in resolved:
+            if isinstance(product_id, tuple):
+                for var_id, _ in rows:
+                    ids_by_var_id[var_id] = new_ids[product_id[1]]
+                    if ids_by_sku.get(var_id) == product_id:
+                        ids_by_sku[var_id] = new_ids[product_id[1]]
+        self.ids_by_sku.update(ids_by_sku.maps[0])
+        self.ids_by_var_id.update(ids_by_var_id.maps[0])
+
+        new_products = sum(1 for _, db_status, _ in results if db_status == 'NEW')
+        print(f"Saved {len(results)} products ({new_products} new, {len(results) - new_products} updated, "
+              f"{len(unchanged)} unchanged)")
+        return results + [(element, UNCHANGED_STATUS, None) for element in unchanged]
+
+    def mark_unchanged(self, elements):
+        """Applies UNCHANGED_TRANSITIONS to the variants of the vendor's products at the elements' URLs."""
+        if not elements:
+            return
+        query = sql.SQL("""
+            UPDATE {} v
+            SET status_int = CASE v.status_int {} END
+            FROM {} p
+            WHERE p.product_id = v.product_id
+            AND p.{} = %s
+            AND p.url = ANY(%s)
+            AND v.status_int = ANY(%s)
+        """).format(
+            sql.Identifier(VARIANT_LOOKUP_TABLE),
+            sql.SQL(' ').join(
+                sql.SQL("WHEN {} THEN {}").format(sql.Literal(old_status), sql.Literal(new_status))
+                for old_status, new_status in UNCHANGED_TRANSITIONS.items()
+            ),
+            sql.Identifier(PRODUCT_TABLE),
+            sql.Identifier(self.vendor_column)
+        )
+        self.cursor.execute(query, (self.vendor_value, [element['url'] for element in elements],
+                                    list(UNCHANGED_TRANSITIONS)))
+
+    def write(self, resolved, new_ids):
+        """Upserts the resolved products of a batch, new_ids replacing the placeholder ids."""
+        def real_id(product_id):
+            if isinstance(product_id, tuple):
+                return new_ids[product_id[1]]
+            return product_id
+
+        # Later rows for the same product / variant win, as they would have
+        # overwritten the earlier ones row by row
+        product_rows = {}
+        variant_rows = {}
+        results = []
+        for element, product_data, rows, db_status, product_id in resolved:
+            product_id = real_id(product_id)
+            product_rows[product_id] = (
+                product_id,
+                *(prepare_data_for_sql(product_data.get(key, None)) for key in PRODUCT_FIELDS.values()),
+                db_status
+            )
+            for var_id, variant in rows:
+                variant_rows[var_id] = (
+                    var_id, product_id, prepare_data_for_sql(var_id),
+                    *(prepare_data_for_sql(variant.get(key, None)) for key in VARIANT_FIELDS.values()),
+                    db_status
+                )
+            results.append((element, db_status, product_id))
+
+        extras.execute_values(self.cursor, PRODUCT_UPSERT_QUERY, list(product_rows.values()), page_size=len(product_rows))
+        if variant_rows:
+            extras.execute_values(self.cursor, VARIANT_UPSERT_QUERY, list(variant_rows.values()), page_size=len(variant_rows))
+        return results
+
+# Webdriver settings
+# URL patterns behind each BLOCK_RESOURCES group (CDP Network.setBlockedURLs wildcards)
+BLOCKED_URL_PATTERNS = {
+    'image': ['*.jpg*', '*.jpeg*', '*.png*', '*.gif*', '*.webp*', '*.avif*', '*.svg*', '*.ico*'],
+    'media': ['*.mp4*', '*.webm*', '*.mov*', '*.m3u8*', '*.mp3*', '*youtube.com/embed/*', '*player.vimeo.com*'],
+    'font': ['*.woff*', '*.ttf*', '*.otf*', '*.eot*', '*fonts.googleapis.com*', '*fonts.gstatic.com*'],
+    'analytics': [
+        '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*', '*connect.facebook.net*',
+        '*facebook.com/tr*', '*hotjar.com*', '*clarity.ms*', '*bat.bing.com*', '*analytics.tiktok.com*',
+        '*ct.pinterest.com*', '*nr-data.net*', '*monorail-edge.shopifysvc.com*'
+    ],
+}
+
+def block_resources(driver, groups=BLOCK_RESOURCES):
+    """Makes Chrome fail every request in the given resource groups, replacing the previous list."""
+    patterns = [pattern for group in groups for pattern in BLOCKED_URL_PATTERNS[group]]
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+
+def setup_driver(cache_slot=0):
+    """
+    Lean headless Chrome: blocked BLOCK_RESOURCES, 'eager' page loads (driver.get
+    returns at DOMContentLoaded, the waits cover the rest) and a persistent
+    disk cache. cache_slot (a number or a DriverPool slot name) keeps
+    drivers running side by side on separate cache directories.
+    """
+    # Settings
+    options = webdriver.ChromeOptions()
+    options.page_load_strategy = 'eager'
+    options.add_argument('--headless')
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    options.add_argument('--window-size=1920,1080')
+    # Not incognito, it keeps the cache in memory only
+    options.add_argument(f'--disk-cache-dir={os.path.abspath(os.path.join(CHROME_CACHE_DIR, str(cache_slot)))}')
+    options.add_argument(f'--disk-cache-size={CHROME_CACHE_SIZE}')
+    # User agent
+    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36')
+        
+    driver = webdriver.Chrome(options=options)
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": ACTIVITY_PROBE})
+    driver.execute_cdp_cmd("Network.enable", {})
+    block_resources(driver)
+    return driver
+
+# Page activity probe injected into every document by setup_driver: the time of
+# the last DOM mutation, the last network event and the fetch/XHR calls in flight
+ACTIVITY_PROBE = """
+(() => {
+    if (window.__activity) return;
+    const activity = window.__activity = {dom: performance.now(), net: performance.now(), pending: 0};
+    const mutated = () => { activity.dom = performance.now(); };
+    const started = () => { activity.pending++; activity.net = performance.now(); };
+    const finished = () => { activity.pending = Math.max(0, activity.pending - 1); activity.net = performance.now(); };
+    new MutationObserver(mutated).observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    if (window.PerformanceObserver) {
+        new PerformanceObserver(() => { activity.net = performance.now(); }).observe({type: 'resource'});
+    }
+    if (window.fetch) {
+        const fetch = window.fetch;
+        window.fetch = function () { started(); return fetch.apply(this, arguments).finally(finished); };
+    }
+    const send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        started();
+        this.addEventListener('loadend', finished);
+        return send.apply(this, arguments);
+    };
+})();
+"""
+
+# Quiet times are measured from the last activity or from `since`
+# (an activity_mark taken before a click or scroll), whichever is later,
+# so a page that was idle before the action is not taken as settled after it
+ACTIVITY_STATE = """
+const activity = window.__activity;
+if (!activity) return null;
+const now = performance.now();
+const since = arguments[0] === null ? 0 : arguments[0];
+return [(now - Math.max(activity.dom, since)) / 1000, (now - Math.max(activity.net, since)) / 1000, activity.pending];
+"""
+
+ACTIVITY_MARK = "return window.__activity ? performance.now() : null;"
+
+def activity_mark(driver):
+    """Page clock to pass as `since` to the activity conditions, taken right before a click or scroll."""
+    return driver.execute_script(ACTIVITY_MARK)
+
+def dom_settled(quiet=SETTLE_TIME, since=None):
+    """WebDriverWait condition: no DOM mutation for `quiet` seconds."""
+    def _predicate(driver):
+        state = driver.execute_script(ACTIVITY_STATE, since)
+        return state is None or state[0] >= quiet
+    return _predicate
+
+def network_idle(quiet=SETTLE_TIME, since=None):
+    """WebDriverWait condition: no fetch/XHR in flight and no network event for `quiet` seconds."""
+    def _predicate(driver):
+        state = driver.execute_script(ACTIVITY_STATE, since)
+        return state is None or (state[2] == 0 and state[1] >= quiet)
+    return _predicate
+
+def page_settled(quiet=SETTLE_TIME, since=None):
+    """WebDriverWait condition: both the DOM and the network have been quiet for `quiet` seconds."""
+    dom, network = dom_settled(quiet, since), network_idle(quiet, since)
+    return lambda driver: dom(driver) and network(driver)
+
+def text_changed(locator, old_text):
+    """WebDriverWait condition: the text of the element at locator is no longer old_text."""
+    def _predicate(driver):
+        try:
+            return driver.find_element(*locator).get_attribute('textContent') != old_text
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+    return _predicate
+
+def element_count_above(locator, count):
+    """WebDriverWait condition: more than count elements match locator."""
+    return lambda driver: len(driver.find_elements(*locator)) > count
+
+def element_text(driver, locator):
+    try:
+        return driver.find_element(*locator).get_attribute('textContent')
+    except NoSuchElementException:
+        return None
+
+def wait_for(driver, condition, timeout=WAIT_TIMEOUT):
+    """Waits until condition holds, returns False instead of raising if it times out."""
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL).until(condition)
+    except TimeoutException:
+        return False
+
+# One keep-alive HTTP session per worker thread (requests.Session is not thread safe)
+_http = threading.local()
+
+def get_http_session():
+    session = getattr(_http, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(headers)
+        retries = Retry(total=3, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=retries)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _http.session = session
+    return session
+
+# Returned by the fetchers when a conditional request comes back 304
+NOT_MODIFIED = object()
+
+def conditional_headers(validators):
+    request_headers = {}
+    if validators and validators.get('etag'):
+        request_headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        request_headers['If-Modified-Since'] = validators['last_modified']
+    return request_headers
+
+def update_validators(validators, response_headers):
+    if validators is None:
+        return
+    for key, header in (('etag', 'etag'), ('last_modified', 'last-modified')):
+        if response_headers.get(header):
+            validators[key] = response_headers.get(header)
+
+def fetch_page_http(url, markers, timeout=15, validators=None):
+    """
+    Fetches a product page with a plain HTTP request.
+    Returns None when the request fails or the page needs JS to render
+    (the server-rendered HTML lacks one of markers), so the caller can
+    fall back to Selenium.
+    validators (see CrawlJournal.validators) makes it a conditional
+    request: NOT_MODIFIED is returned on a 304 and the dict is updated
+    with the ETag/Last-Modified of the response.
+    """
+    try:
+        response = get_http_session().get(url, timeout=timeout, headers=conditional_headers(validators))
+    except requests.RequestException as e:
+        print(f"HTTP fetch failed for {url}: {e}")
+        return None
+    if response.status_code == 304:
+        return NOT_MODIFIED
+    update_validators(validators, response.headers)
+    if response.status_code != 200:
+        print(f"HTTP fetch returned {response.status_code} for {url}")
+        return None
+    html = response.text
+    if not all(marker in html for marker in markers):
+        return None
+    return html
+
+class CrawlJournal:
+    """
+    Per-URL crawl state kept in a SQLite file next to the data files:
+    pending -> fetched -> parsed -> upserted (or skipped when there is
+    nothing to write), plus a hash of the fetched page. If a run dies,
+    the next one resumes with the URLs that never got to upserted/skipped
+    instead of starting the catalog over.
+
+    For incremental runs it also keeps a fingerprint per URL: the
+    ETag/Last-Modified of the page and a hash of the extracted fields.
+    Fingerprints are only saved once the product is written (or found
+    unchanged), so a product lost in a crash is never taken as unchanged.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS crawl_journal (
+                cat TEXT NOT NULL,
+                url TEXT NOT NULL,
+                name TEXT,
+                position INTEGER,
+                state TEXT NOT NULL,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fields_hash TEXT,
+                updated_at TEXT,
+                PRIMARY KEY (cat, url)
+            );
+            CREATE TABLE IF NOT EXISTS crawl_run (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                status TEXT NOT NULL,
+                started_at TEXT
+            );
+        """)
+        # Fingerprints seen in this run, saved by mark() once the product is written
+        self.fingerprints = {}
+
+    def unfinished(self):
+        """
+        True if the last run stopped before finish() was called. A run that
+        died while still discovering URLs is not resumed, the next one starts over.
+        """
+        row = self.db.execute("SELECT status FROM crawl_run WHERE id = 1").fetchone()
+        return bool(row) and row[0] == 'running'
+
+    def start(self, elements=None):
+        """
+        Registers the URL list of a new run; rows from older runs are kept as 'stale'.
+        Without elements the run is still discovering: URLs come in through
+        add() and discovered() marks the list complete.
+        """
+        with self.lock, self.db:
+            self.db.execute("UPDATE crawl_journal SET state = 'stale', position = NULL")
+            self.db.execute("""
+                INSERT OR REPLACE INTO crawl_run (id, status, started_at)
+                VALUES (1, ?, datetime('now'))
+            """, ('discovering' if elements is None else 'running',))
+        if elements is not None:
+            self.add(elements)
+
+    def add(self, elements):
+        """Appends newly discovered URLs to the current run as 'pending'."""
+        with self.lock, self.db:
+            start = self.db.execute("SELECT COALESCE(MAX(position) + 1, 0) FROM crawl_journal").fetchone()[0]
+            self.db.executemany("""
+                INSERT INTO crawl_journal (cat, url, name, position, state, updated_at)
+                VALUES (?, ?, ?, ?, 'pending', datetime('now'))
+                ON CONFLICT (cat, url) DO UPDATE SET
+                    name = excluded.name, position = excluded.position,
+                    state = 'pending', updated_at = excluded.updated_at
+            """, [(e['cat'], e['url'], e.get('name'), start + i) for i, e in enumerate(elements)])
+
+    def discovered(self):
+        with self.lock, self.db:
+            self.db.execute("UPDATE crawl_run SET status = 'running' WHERE id = 1")
+
+    def remaining(self):
+        """URLs of the current run that were not written yet, in crawl order."""
+        with self.lock:
+            rows = self.db.execute("""
+                SELECT cat, url, name FROM crawl_journal
+                WHERE state IN ('pending', 'fetched', 'parsed')
+                ORDER BY position
+            """).fetchall()
+        return [{'cat': cat, 'url': url, 'name': name} for cat, url, name in rows]
+
+    def mark(self, elements, state, content_hash=None):
+        with self.lock, self.db:
+            self.db.executemany("""
+                UPDATE crawl_journal
+                SET state = ?, content_hash = COALESCE(?, content_hash), updated_at = datetime('now')
+                WHERE cat = ? AND url = ?
+            """, [(state, content_hash, e['cat'], e['url']) for e in elements])
+            if state not in ('upserted', 'unchanged'):
+                return
+            fingerprints = [(self.fingerprints.pop((e['cat'], e['url']), None), e) for e in elements]
+            self.db.executemany("""
+                UPDATE crawl_journal
+                SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified),
+                    fields_hash = COALESCE(?, fields_hash)
+                WHERE cat = ? AND url = ?
+            """, [(f.get('etag'), f.get('last_modified'), f.get('fields_hash'), e['cat'], e['url'])
+                  for f, e in fingerprints if f])
+
+    def validators(self, element):
+        """
+        Validators dict for fetch_page_http/fetch_async. Holds the stored
+        ETag/Last-Modified in incremental mode and gets the values of the
+        new response either way.
+        """
+        key = (element['cat'], element['url'])
+        with self.lock:
+            fingerprint = self.fingerprints.setdefault(key, {})
+            if INCREMENTAL:
+                row = self.db.execute(
+                    "SELECT etag, last_modified FROM crawl_journal WHERE cat = ? AND url = ?", key
+                ).fetchone()
+                if row:
+                    fingerprint['etag'], fingerprint['last_modified'] = row
+        return fingerprint
+
+    def unchanged(self, element, fields):
+        """True if the extracted fields hash the same as on the last write."""
+        key = (element['cat'], element['url'])
+        payload = json.dumps(fields, sort_keys=True, default=lambda value: sorted(value) if isinstance(value, set) else str(value))
+        fields_hash = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        with self.lock:
+            self.fingerprints.setdefault(key, {})['fields_hash'] = fields_hash
+            row = self.db.execute(
+                "SELECT fields_hash FROM crawl_journal WHERE cat = ? AND url = ?", key
+            ).fetchone()
+        return bool(row) and row[0] == fields_hash
+
+    def fetched(self, element, html):
+        self.mark([element], 'fetched', hashlib.sha256(html.encode('utf-8')).hexdigest())
+
+    def finish(self):
+        with self.lock, self.db:
+            self.db.execute("UPDATE crawl_run SET status = 'done' WHERE id = 1")
+        self.db.close()
+def process_tree_rss_mb(pid):
+    """Resident memory of a process and all of its children in MB, None where /proc is not available."""
+    if not os.path.isdir('/proc'):
+        return None
+    total_kb = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+            for task in os.listdir(f'/proc/{pid}/task'):
+                with open(f'/proc/{pid}/task/{task}/children') as children:
+                    pids.extend(int(child) for child in children.read().split())
+        except (OSError, ValueError):
+            continue
+    return total_kb / 1024
+
+class DriverSlot:
+    """One pooled Chrome driver, started on first use and restarted after quit()."""
+
+    def __init__(self, cache_slot):
+        self.cache_slot = cache_slot
+        self.driver = None
+        self.pages = 0
+        self.used = False
+
+    def get(self):
+        if self.driver is None:
+            self.driver = setup_driver(self.cache_slot)
+            self.pages = 0
+        self.used = True
+        return self.driver
+
+    def alive(self):
+        if self.driver is None:
+            return True
+        try:
+            self.driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def rss_mb(self):
+        try:
+            return process_tree_rss_mb(self.driver.service.process.pid)
+        except AttributeError:
+            return None
+
+    def quit(self):
+        if self.driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                print(f"Error closing Chrome: {e}")
+        self.driver = None
+
+class DriverPool:
+    """
+    Warm headless Chrome drivers shared by the crawl workers. A worker takes
+    a slot with acquire() and hands it back with release(), which recycles
+    the driver after DRIVER_MAX_PAGES pages or once Chrome grows past
+    DRIVER_MAX_RSS_MB. The next get() starts a fresh one.
+    """
+
+    def __init__(self, size, name='crawl', max_pages=DRIVER_MAX_PAGES, max_rss_mb=DRIVER_MAX_RSS_MB):
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        # Cache slot 0 belongs to the script's own driver, pools use <name>-1..<name>-size
+        self.slots = [DriverSlot(f"{name}-{n + 1}") for n in range(size)]
+        self.free_slots = queue.Queue()
+        for slot in self.slots:
+            self.free_slots.put(slot)
+
+    def acquire(self):
+        slot = self.free_slots.get()
+        slot.used = False
+        return slot
+
+    def release(self, slot):
+        if slot.used and slot.driver is not None:
+            slot.pages += 1
+            rss = slot.rss_mb() if self.max_rss_mb else None
+            if self.max_pages and slot.pages >= self.max_pages:
+                print(f"Recycling Chrome after {slot.pages} pages")
+                slot.quit()
+            elif rss is not None and rss > self.max_rss_mb:
+                print(f"Recycling Chrome at {rss:.0f} MB after {slot.pages} pages")
+                slot.quit()
+        self.free_slots.put(slot)
+
+    def run(self, func, label):
+        """
+        Calls func(get_driver), where get_driver() takes a slot on first use,
+        so work that never needs Chrome never waits for one. If the Chrome
+        session died on the way, func runs once more on a fresh driver.
+        """
+        slot = None
+
+        def get_driver():
+            nonlocal slot
+            if slot is None:
+                slot = self.acquire()
+            return slot.get()
+
+        try:
+            for attempt in range(2):
+                try:
+                    result = func(get_driver)
+                except WebDriverException:
+                    if slot is None or slot.alive():
+                        raise
+                    result = None
+                # fetch_page and friends swallow errors, so a None result is checked as well
+                if result is not None or slot is None or slot.alive():
+                    return result
+                print(f"Chrome session died on {label}, starting a new one")
+                slot.quit()
+            return None
+        finally:
+            if slot is not None:
+                self.release(slot)
+
+    def close(self):
+        for slot in self.slots:
+            slot.quit()
+
+def crawl_products(product_urls, scrape_product, workers=DRIVER_WORKERS):
+    """
+    Spreads product URLs across a pool of worker threads, each taking a
+    headless Chrome driver from a DriverPool that scrape_product gets
+    through get_driver(). A page whose Chrome session died is retried
+    once on a fresh driver. Results are yielded back to the caller (the
+    single DB writer) as soon as they are ready.
+
+    product_urls can also be a generator still discovering URLs: it is
+    read on a feeder thread and every URL is scraped as soon as it shows up.
+    """
+    if hasattr(product_urls, '__len__'):
+        workers = max(1, min(workers, len(product_urls)))
+    # Drivers are started lazily, so pages served over plain HTTP never launch Chrome
+    pool = DriverPool(workers)
+
+    def run(element):
+        try:
+            return element, pool.run(lambda get_driver: scrape_product(element, get_driver), element['url'])
+        except Exception as e:
+            print(f"Error scraping {element['url']}: {e}")
+            return element, None
+
+    results = queue.Queue()
+    submitted = object()
+
+    def feed(executor):
+        count = 0
+        try:
+            for element in product_urls:
+                executor.submit(run, element).add_done_callback(lambda future: results.put(future.result()))
+                count += 1
+        except Exception as e:
+            print(f"Product URL discovery stopped: {e}")
+        finally:
+            results.put((submitted, count))
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            feeder = threading.Thread(target=feed, args=(executor,), daemon=True)
+            feeder.start()
+            received = 0
+            total = None
+            while total is None or received < total:
+                item = results.get()
+                if item[0] is submitted:
+                    total = item[1]
+                    continue
+                received += 1
+                yield item
+            feeder.join()
+    finally:
+        pool.close()
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class HostLimiter:
+    """Per-host semaphore and token bucket shared by all async crawl workers."""
+
+    def __init__(self, concurrency=HOST_CONCURRENCY, rate=HOST_RATE):
+        self.concurrency = concurrency
+        self.rate = rate
+        self.hosts = {}
+
+    def get(self, url):
+        host = urlparse(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = (asyncio.Semaphore(self.concurrency), TokenBucket(self.rate))
+        return self.hosts[host]
+
+async def fetch_async(request_context, limiter, url, retries=3, validators=None):
+    """
+    Fetches a page through the Playwright request context under its host
+    limits. validators works like in fetch_page_http.
+    """
+    semaphore, bucket = limiter.get(url)
+    for attempt in range(retries):
+        async with semaphore:
+            await bucket.acquire()
+            try:
+                response = await request_context.get(url, timeout=15000, headers=conditional_headers(validators))
+                if response.status == 304:
+                    return NOT_MODIFIED
+                if response.ok:
+                    update_validators(validators, response.headers)
+                    return await response.text()
+                print(f"Async fetch returned {response.status} for {url}")
+                if response.status not in (429, 500, 502, 503, 504):
+                    return None
+            except PlaywrightError as e:
+                print(f"Async fetch failed for {url}: {e}")
+        # Back off outside the semaphore so other pages keep flowing
+        await asyncio.sleep(2 ** attempt)
+    return None
+
+async def _crawl_async(product_urls, scrape_async, results):
+    limiter = HostLimiter()
+    pending = asyncio.Queue(maxsize=ASYNC_CONCURRENCY)
+    # Elements taken from product_urls that have no result yet, reported as
+    # failed if the event loop dies under them
+    in_flight = {}
+
+    async with async_playwright() as p:
+        request_context = await p.request.new_context(extra_http_headers=headers)
+
+        async def fetch(url, validators=None):
+            return await fetch_async(request_context, limiter, url, validators=validators)
+
+        async def feed():
+            # product_urls can be a generator still discovering URLs in a
+            # browser, so it is read on a worker thread off the event loop
+            done = object()
+            try:
+                while True:
+                    element = await asyncio.to_thread(next, product_urls, done)
+                    if element is done:
+                        break
+                    in_flight[id(element)] = element
+                    await pending.put(element)
+            except Exception as e:
+                print(f"Product URL discovery stopped: {e}")
+            finally:
+                for _ in range(ASYNC_CONCURRENCY):
+                    await pending.put(None)
+
+        async def worker():
+            while True:
+                element = await pending.get()
+                if element is None:
+                    return
+                try:
+                    scraped = await scrape_async(element, fetch)
+                except Exception as e:
+                    print(f"Error scraping {element['url']}: {e}")
+                    scraped = None
+                del in_flight[id(element)]
+                results.put((element, scraped))
+
+        try:
+            await asyncio.gather(feed(), *(worker() for _ in range(ASYNC_CONCURRENCY)))
+        finally:
+            await request_context.dispose()
+            for element in in_flight.values():
+                results.put((element, None))
+            in_flight.clear()
+
+def crawl_products_async(product_urls, scrape_async, scrape_product):
+    """
+    Runs the asyncio crawler in a background thread and yields
+    (element, result) pairs like crawl_products. product_urls can be a
+    generator still discovering URLs, they are fed to ASYNC_CONCURRENCY
+    workers as they come in. Pages scrape_async returns None for
+    (JS-rendered or failed) are collected on the way and retried
+    afterwards on the Chrome driver pool with scrape_product.
+    """
+    product_urls = iter(product_urls)
+    results = queue.Queue()
+    done = object()
+
+    def run():
+        try:
+            asyncio.run(_crawl_async(product_urls, scrape_async, results))
+        except Exception as e:
+            print(f"Async crawl stopped: {e}")
+        finally:
+            results.put(done)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    fallback = []
+    while True:
+        item = results.get()
+        if item is done:
+            break
+        element, scraped = item
+        if scraped is None:
+            fallback.append(element)
+            continue
+        yield element, scraped
+    thread.join()
+
+    # product_urls is only left over if the async crawl stopped early
+    rest = next(product_urls, None)
+    if rest is not None:
+        print("Async crawl stopped early, the remaining pages go to Chrome")
+        fallback = itertools.chain(fallback, [rest], product_urls)
+    elif fallback:
+        print(f"Retrying {len(fallback)} pages in Chrome")
+    if fallback:
+        yield from crawl_products(fallback, scrape_product)
+
+# Parse worker processes, shared by everything that hands raw HTML off the fetch threads
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+def get_parse_pool():
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            # spawn, not fork: the crawl threads and their locks must not be copied into the workers
+            _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _parse_pool
+
+def submit_parse(func, *args):
+    """
+    Runs func(*args) in the parse processes with PARSE_PROCESSES, right away
+    on the calling thread otherwise. Returns a Future either way, so the
+    caller can go on driving the browser while the page is parsed.
+    """
+    if PARSE_PROCESSES:
+        return get_parse_pool().submit(func, *args)
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+class StageStats:
+    """
+    Throughput of one pipeline stage: items done, time its workers spent
+    working and time they spent blocked on a full queue to the next stage.
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add(self, busy, blocked=0.0):
+        with self.lock:
+            self.items += 1
+            self.busy += busy
+            self.blocked += blocked
+
+    def done(self):
+        self.finished = time.perf_counter()
+
+    def report(self):
+        elapsed = max((self.finished or time.perf_counter()) - self.started, 1e-9)
+        return (f"{self.name:<10}{self.workers:>4} workers {self.items:>8} items {self.items / elapsed:>8.1f}/s"
+                f"  busy {self.busy / (elapsed * self.workers):>4.0%}  blocked {self.blocked:>7.1f}s")
+
+_STOP = object()
+
+def start_stage(stage, inbox, outbox, stats, stopping):
+    """
+    Starts the worker threads of one (name, func, workers) stage and returns
+    them. Each item is an (element, payload) pair, func(element, payload)
+    returns the payload for the next stage. When the stop marker comes in,
+    every worker passes it on to its siblings and the last one to leave
+    sends it downstream. Once the stopping event is set, items still coming
+    in are dropped unprocessed.
+    """
+    name, func, workers = stage
+    running = [workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = inbox.get()
+            if item is _STOP:
+                inbox.put(_STOP)
+                break
+            if stopping.is_set():
+                continue
+            element, payload = item
+            start = time.perf_counter()
+            try:
+                payload = func(element, payload)
+            except Exception as e:
+                print(f"Error in {name} stage for {element['url']}: {e}")
+                payload = None
+            busy = time.perf_counter() - start
+            outbox.put((element, payload))
+            stats.add(busy, time.perf_counter() - start - busy)
+        with lock:
+            running[0] -= 1
+            last = running[0] == 0
+        if last:
+            stats.done()
+            outbox.put(_STOP)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def crawl_pipeline(product_urls, stages, queue_size=PIPELINE_QUEUE_SIZE):
+    """
+    Streaming crawl: a producer thread feeds product_urls (a list or a
+    generator still discovering them) into the first of the (name, func,
+    workers) stages, each stage runs on its own threads, and the caller
+    consuming the yielded (element, payload) pairs is the sink. Every queue
+    holds at most queue_size items, so a slow stage holds back the ones
+    before it instead of letting pages pile up in memory. Per-stage
+    throughput is printed when the crawl ends.
+
+    If the caller stops consuming early (closes the generator or raises),
+    the producer stops feeding, the stages drop what is left and every
+    thread is joined before the generator returns.
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    producer = StageStats('produce', 1)
+    stats = [StageStats(name, workers) for name, _, workers in stages]
+    sink = StageStats('sink', 1)
+    stopping = threading.Event()
+
+    def produce():
+        try:
+            for element in product_urls:
+                if stopping.is_set():
+                    break
+                start = time.perf_counter()
+                queues[0].put((element, None))
+                producer.add(0.0, time.perf_counter() - start)
+        except Exception as e:
+            print(f"Product URL producer stopped: {e}")
+        finally:
+            producer.done()
+            queues[0].put(_STOP)
+
+    threads = [threading.Thread(target=produce, daemon=True)]
+    for stage, inbox, outbox, stage_stats in zip(stages, queues, queues[1:], stats):
+        threads.extend(start_stage(stage, inbox, outbox, stage_stats, stopping))
+    threads[0].start()
+
+    finished = False
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _STOP:
+                finished = True
+                break
+            start = time.perf_counter()
+            yield item
+            sink.add(time.perf_counter() - start)
+    finally:
+        if not finished:
+            # Unblock the last stage and wait for the stop marker to come through
+            stopping.set()
+            while queues[-1].get() is not _STOP:
+                pass
+        for thread in threads:
+            thread.join()
+        sink.done()
+        print("Pipeline throughput:")
+        for stage_stats in [producer, *stats, sink]:
+            print(f"  {stage_stats.report()}")
@@ -1,6 +1,8 @@
 import re
 import json
 from bs4 import BeautifulSoup as bs
+import lxml.html
+from lxml import etree
 import pandas as pd
 import time
 from pandas.core.methods.describe import describe_numeric_1d
@@ -15,6 +17,10 @@ from selenium.common.exceptions import ElementClickInterceptedException, StaleEl
 import csv
 import os
 import itertools
+import threading
+from contextlib import closing
+import asyncio
+import requests
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2 import sql, extras
@@ -40,14 +46,52 @@ DB_CONFIG = {
     "port": DB_PORT
 }
 
+# Crawl infrastructure shared by the scrapers, reads its settings from the env loaded above
+sys.path.insert(0, os.path.join(script_dir, '..', '..', 'common'))
+from crawl_common import (
+    BLOCK_RESOURCES, block_resources, crawl_pipeline, crawl_products, crawl_products_async,
+    CrawlJournal, dom_settled, DRIVER_WORKERS, DriverPool, element_count_above, element_text,
+    fetch_page_http, FETCH_WORKERS, get_http_session, get_parse_pool, INCREMENTAL, network_idle,
+    NOT_MODIFIED, page_settled, PARSE_WORKERS, ProductWriter, setup_driver, submit_parse,
+    text_changed, UNCHANGED_STATUS, wait_for
+)
+
 
 # TRUE - IF URL LIST .CSV FILE IS READY
 CSV_READY = True
 
+# How product URLs are discovered when CSV_READY is off:
+# json - Shopify collections.json and <collection>/products.json, no browser
+# browser - walk the collection pages in Chrome and scroll every collection
+DISCOVERY_MODE = os.getenv("DISCOVERY_MODE", "json")
+
+# Page size of the Shopify listing endpoints (250 is the most Shopify returns)
+SHOPIFY_PAGE_LIMIT = 250
+
+# http - plain keep-alive HTTP request first, Chrome only for pages that need JS
+# selenium - always render product pages in Chrome
+FETCH_MODE = os.getenv("FETCH_MODE", "http")
+
+# pool - product pages go through the Chrome driver pool (crawl_products)
+# async - asyncio HTTP crawler (crawl_products_async), Chrome only as a fallback
+# pipeline - bounded-queue stages (crawl_pipeline): fetch threads, parse processes, DB sink
+CRAWL_MODE = os.getenv("CRAWL_MODE", "pool")
+
+# lxml - product pages are parsed once by lxml.html and read with precompiled XPath
+# bs4 - BeautifulSoup with the CSS selectors
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "lxml")
+
+# Scroll rounds in a row that bring no new product links before a collection
+# listing that is still short of its expected count is given up on
+HARVEST_EMPTY_ROUNDS = int(os.getenv("HARVEST_EMPTY_ROUNDS", 3))
+
 CSV = '../data/kbeauty_url.csv'
 PROD_DEBUG_FILE = '../data/debug_kbeauty.log'
 URL_DEBUG_FILE = '../data/debug_kbeauty_url.log'
 
+# Per-URL crawl state, lets an interrupted run resume where it stopped
+JOURNAL_FILE = '../data/kbeauty_journal.sqlite'
+
 # UPDATE WITH REAL DATA
 
 ITEM = "h3[class='product-item__product-title fs-product-title ff-heading']" # Item CSS selector from list page
@@ -65,494 +109,12 @@ BRAND = 'div[class="product__vendor fs-body-100"]'
 
 
 
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Referer": "https://google.com",
-    "DNT": "0"
-}
-
-PRODUCT_TABLE = 'product_db'
-VARIANT_LOOKUP_TABLE = 'variant_db'
-
-# Note: I am assuming the connection and transaction (conn) is managed by the caller,
-# and this function only executes queries and does NOT manage the connection itself.
-
-def prepare_data_for_sql(value: Any) -> Optional[Union[str, int, float, bool]]:
-    """
-    Standardizes Python values for safe insertion into PostgreSQL via psycopg2.
-    1. Converts sets and lists (of primitives) to comma-separated strings.
-    2. Converts empty strings ("") to None (SQL NULL).
-    3. Returns None for None.
-    """
-    if value is None:
-        return None
-    
-    # 1. Handle collections (sets and lists) by converting them to strings
-    if isinstance(value, (set, list)):
-        # Join list/set items into a comma-separated string
-        try:
-            # Use map(str, value) to ensure all items are strings before joining
-            return ", ".join(map(str, value))
-        except Exception as e:
-            # Fallback if the collection contains complex, unjoinable objects
-            print(f"Warning: Could not stringify collection {value}. Error: {e}. Sending NULL.")
-            return None
-
-    # 2. Handle empty strings (crucial for numeric fields like price)
-    if isinstance(value, str) and value.strip() == "":
-        return None # Translates to SQL NULL
-    
-    # 3. Handle other types (int, float, bool, non-empty str, etc.)
-    return value
-
-def upsert_single_variant(
-    product_data: Dict[str, Any], 
-    target_sku: str, 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-
-    # A. LOOKUP by SKU
-    select_query = sql.SQL("SELECT product_id FROM {} WHERE sku = {}").format(
-        sql.Identifier(PRODUCT_TABLE),
-        sql.Literal(target_sku)
-    )
-    cursor.execute(select_query)
-    result = cursor.fetchone()
-    product_id = result[0] if result else None
-    
-    db_status = None
-    image_urls: List[str] = product_data.get('Image Src', [])
-    image_urls = list(image_urls)
-    if image_urls:
-        product_data['var_img'] = image_urls[0]
-    else:
-        product_data['var_img'] = ""
-
-    # --- B. UPDATE LOGIC (If product_id exists - Rule 2) ---
-    if product_id:
-        status_to_set = 'UPD'
-        db_status = 'UPD'
-
-        # 1. Product Table UPDATE
-        update_product_query = sql.SQL("""
-            UPDATE {}
-            SET 
-                cat = {}, url = {}, cat_name = {}, title = {}, sku = {}, image_url = {}, 
-                descr = {}, cert = {}, opt_1 = {}, opt_2 = {}, opt_3 = {}, tags = {}, 
-                product_category = {}, type = {}, vendor = {}, inventory_tracker = {}, 
-                inventory_quantity = {}, debug_1 = {}, debug_2 = {}, debug_3 = {},
-                handle = {}, status_int = {}, status = {} 
-            WHERE product_id = {}
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))), 
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant SKU", None))), # Use Variant SKU for product.sku
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))), 
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(product_id)
-        )
-        cursor.execute(update_product_query)
-
-
-
-        # 2. Variant Table UPSERT (for the single variant, using target_sku as var_id)
-        upsert_variant_query = sql.SQL("""
-            INSERT INTO {} (
-                var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                price, cost, compare, upc, weight, weight_grams, published, status_int, 
-                debug_1, debug_2, debug_3, vendor
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-            )
-            ON CONFLICT (var_id) DO UPDATE SET 
-                var_image_url = EXCLUDED.var_image_url,
-                price = EXCLUDED.price, cost = EXCLUDED.cost, compare = EXCLUDED.compare,
-                upc = EXCLUDED.upc, weight = EXCLUDED.weight, published = EXCLUDED.published,
-                status = EXCLUDED.status;
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            # Variant VALUES (using single product_data dict)
-            sql.Literal(target_sku), 
-            sql.Literal(product_id),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("var_img", None))),
-            sql.Literal(prepare_data_for_sql(target_sku)),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Price", None))),        # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("cost", None))),         # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Compare At Price", None))),      # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Barcode", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight", None))),       # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("weight_grams", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("published", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None)))
-        )
-        cursor.execute(upsert_variant_query)
-
-        
-        
-    # --- C. INSERT LOGIC (If product_id does NOT exist - Rule 1) ---
-    else:
-        status_to_set = 'NEW'
-        db_status = 'NEW'
-        
-        # 1. Product Table INSERT (RETURNING product_id)
-        insert_product_query = sql.SQL("""
-            INSERT INTO {} (
-                cat, url, cat_name, title, sku, image_url, descr, cert, opt_1, opt_2, opt_3, 
-                tags, product_category, type, vendor, inventory_tracker, inventory_quantity, 
-                debug_1, debug_2, debug_3, handle, status, status_int
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}
-            )
-            RETURNING product_id;
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant SKU", None))), # Use Variant SKU for product.sku
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(status_to_set)
-        )
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0] 
-        
-        # 2. Variant Table INSERT (for the single variant)
-        insert_variant_query = sql.SQL("""
-            INSERT INTO {} (
-                var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val,
-                price, cost, compare, upc, weight, weight_grams, published, status_int,
-                debug_1, debug_2, debug_3, vendor
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-            );
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            sql.Literal(target_sku),
-            sql.Literal(product_id),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("var_img", None))),
-            sql.Literal(prepare_data_for_sql(target_sku)),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Price", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cost", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Compare At Price", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Barcode", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight_grams", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("published", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None)))
-        )
-        cursor.execute(insert_variant_query)
-
-        
-
-    return db_status, product_id
-
-# --- HELPER FUNCTION 2: Multi-Variant Logic (Rules 3 & 4) ---
-
-def upsert_multi_variant(
-    product_data: Dict[str, Any], 
-    variants: List[Dict[str, Any]], 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-
-    # A. LOOKUP by Handle
-    variant_skus = [v.get("Variant SKU") for v in variants if v.get("Variant SKU")]
-
-    product_id = None
-    
-    if variant_skus:
-        # 2. Build the WHERE var_id IN (...) clause from the list of SKUs
-        print(len(variant_skus))
-        sku_literals = sql.SQL(', ').join(sql.Literal(sku) for sku in variant_skus)
-        
-        select_query = sql.SQL("""
-            SELECT product_id 
-            FROM {} 
-            WHERE var_id IN ({})
-            LIMIT 1
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            sku_literals
-        )
-        
-        cursor.execute(select_query)
-        result = cursor.fetchone()
-        product_id = result[0] if result else None
-    
-    db_status = None
-
-    # --- UPD PATH (Rule 3: Product exists, Update product and variants) ---
-    if product_id:
-        status_to_set = 'UPD'
-        db_status = 'UPD'
-
-        # 1. Update Product Table
-        update_product_query = sql.SQL("""
-            UPDATE {} SET 
-                cat = {}, url = {}, cat_name = {}, title = {}, image_url = {}, 
-                descr = {}, cert = {}, opt_1 = {}, opt_2 = {}, opt_3 = {}, 
-                tags = {}, product_category = {}, type = {}, vendor = {}, 
-                inventory_tracker = {}, inventory_quantity = {}, debug_1 = {}, 
-                debug_2 = {}, debug_3 = {}, status_int = {}, status = {}, handle = {}
-            WHERE product_id = {}
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))), 
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(product_id)
-            
-        )
-        cursor.execute(update_product_query)
-
-        # 2. Loop and UPSERT Variants (Update existing, Insert new)
-        for variant in variants:
-            var_sku = variant.get("Variant SKU")
-            if not var_sku:
-                print(f"Warning: Variant  is missing SKU. Skipping.")
-                continue
-
-            upsert_variant_query = sql.SQL("""
-                INSERT INTO {} (
-                    var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                    price, cost, compare, upc, weight, weight_grams, published, status, 
-                    debug_1, debug_2, debug_3, vendor
-                )
-                VALUES (
-                    {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-                )
-                ON CONFLICT (var_id) DO UPDATE SET 
-                    var_image_url = EXCLUDED.var_image_url,
-                    price = EXCLUDED.price, cost = EXCLUDED.cost, compare = EXCLUDED.compare,
-                    upc = EXCLUDED.upc, weight = EXCLUDED.weight, published = EXCLUDED.published,
-                    status = EXCLUDED.status, debug_1 = EXCLUDED.debug_1, debug_2 = EXCLUDED.debug_2,
-                    debug_3 = EXCLUDED.debug_3;
-            """).format(
-                sql.Identifier(VARIANT_LOOKUP_TABLE),
-                sql.Literal(var_sku),
-                sql.Literal(product_id),
-                sql.Literal(prepare_data_for_sql(variant.get("Handle", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Image Src", None))),
-                sql.Literal(var_sku),
-                sql.Literal(prepare_data_for_sql(variant.get("Option1 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option2 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option3 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("cost", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Compare At Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Barcode", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight_grams", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("published", None))),
-                sql.Literal(status_to_set),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_1", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_2", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_3", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Vendor", None)))
-            )
-            cursor.execute(upsert_variant_query)
-
-            
-
-    # --- NEW PATH (Rule 4: Product does NOT exist, Insert everything) ---
-    else:
-        status_to_set = 'NEW'
-        db_status = 'NEW'
-
-        # 1. Product Table INSERT (RETURNING product_id)
-        insert_product_query = sql.SQL("""
-            INSERT INTO {} (
-                cat, url, cat_name, title, image_url, descr, cert, opt_1, opt_2, opt_3, 
-                tags, product_category, type, vendor, inventory_tracker, inventory_quantity, 
-                debug_1, debug_2, debug_3, handle, status_int, status
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}
-            )
-            RETURNING product_id;
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None)))
-        )
-
-
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0] 
-        
-        # 2. Loop and INSERT Variants
-        for variant in variants:
-            var_sku = variant.get("Variant SKU")
-            if not var_sku:
-                print(f"Warning: Variant is missing SKU. Skipping.")
-                continue
-
-            insert_variant_query = sql.SQL("""
-                INSERT INTO {} (
-                    var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                    price, cost, compare, upc, weight, weight_grams, published, status_int, 
-                    debug_1, debug_2, debug_3, vendor
-                )
-                VALUES (
-                    {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-                );
-            """).format(
-                sql.Identifier(VARIANT_LOOKUP_TABLE),
-                sql.Literal(var_sku),
-                sql.Literal(product_id),
-                sql.Literal(prepare_data_for_sql(variant.get("Handle", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Image Src", None))),
-                sql.Literal(var_sku),
-                sql.Literal(prepare_data_for_sql(variant.get("Option1 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option2 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option3 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("cost", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Compare At Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Barcode", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight_grams", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("published", None))),
-                sql.Literal(status_to_set),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_1", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_2", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_3", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Vendor", None)))
-            )
-            cursor.execute(insert_variant_query)
-
-            
-            
-    return db_status, product_id
-
-# --- MAIN DISPATCHER FUNCTION ---
-
-def upsert_product_data(
-    product_data: Dict[str, Any], 
-    variants: List[Dict[str, Any]], 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-    """
-    DISPATCHER: Routes data to the single-variant or multi-variant handler.
-    """
-    print(product_data)
-    print(variants)
-    # --- Multi-Variant Product ---
-    if variants:
-        target_sku = variants[0].get("Variant SKU")
-        if not target_sku:
-            print("Error: Single-variant product is missing 'Variant SKU'. Aborting.")
-            return None, None
-            
-        return upsert_multi_variant(product_data, variants, cursor)
-
-    # --- Single-Variant Product ---
-    else:
-        target_sku = product_data.get("Variant SKU")
-        if not target_sku:
-            print("Error: Single-variant product is missing 'Variant SKU'. Aborting.")
-            return None, None
-            
-        return upsert_single_variant(product_data, target_sku, cursor)
+# Server-rendered HTML must contain all of these for parse_product to work without JS
+STATIC_PAGE_MARKERS = ('var meta = {', 'product__title')
 
+# Column and value that mark this scraper's rows in product_db / variant_db
+VENDOR_COLUMN = 'vendor'
+VENDOR_VALUE = 'KBeauty'
 
 def debug(urls_stats, prod_stats):
 
@@ -587,83 +149,145 @@ def create_url_handle(title, sku=None):
         return f"{handle_title}_{handle_sku}"
     return handle_title
 
-def extract_sku_from_shopify_meta(soup, var_name):
+class Selector:
     """
-    Locates the Shopify meta script tag and uses a regex to extract the SKU.
+    A CSS selector with its XPath equivalent compiled once at import, so
+    both parser backends run the same query. XPath starting with
+    'descendant::' is relative to the node it is evaluated on, like
+    select_one() on a Tag.
     """
 
+    def __init__(self, css, xpath):
+        self.css = css
+        self.xpath = etree.XPath(xpath, smart_strings=False)
 
-    # 1. Find all script tags
-    script_tags = soup.find_all('script')
+# Text nodes that BeautifulSoup's .text keeps (it leaves out script and style)
+TEXT_NODES = etree.XPath("descendant::text()[not(parent::script or parent::style)]", smart_strings=False)
 
-    # 2. Iterate through scripts to find the one containing 'var meta = {'
-    for script in script_tags:
-        script_text = script.string
-        if script_text and 'var meta = {' in script_text:
+class SoupPage:
+    """Product page parsed with BeautifulSoup, queried with the CSS selectors."""
 
-            # 3. Use regex to reliably extract the JSON content assigned to the 'meta' variable
-            # We look for 'var meta = ' and capture everything up to the first semicolon ';'
-            match = re.search(r'var\s+meta\s*=\s*(\{.*?\});', script_text, re.DOTALL)
+    def __init__(self, html):
+        self.root = bs(html, "lxml")
 
-            if match:
-                # The captured group is the JSON string
-                json_string = match.group(1).strip()
-                
-                try:
-                    # 4. Parse the JSON string
-                    data = json.loads(json_string)
-
-                    # 5. Navigate the JSON structure to find the SKU
-                    # Assuming the SKU is in the first variant (common for product pages)
-                    if data.get('product') and data['product'].get('variants'):
-                        variants = data['product']['variants']
-                        for v in variants:
-                            if var_name in v['public_title']:
-                                return v['sku']
-                        
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON: {e}")
-                    return None
+    def find(self, selector, node=None):
+        return (self.root if node is None else node).select_one(selector.css)
 
-    return None
+    def find_all(self, selector, node=None):
+        return (self.root if node is None else node).select(selector.css)
 
-def extract_sku_from_shopify_meta_no_vars(soup):
-    """
-    Locates the Shopify meta script tag and uses a regex to extract the SKU.
-    """
+    @staticmethod
+    def text(node):
+        return node.text
 
+    @staticmethod
+    def attr(node, name):
+        return node.get(name)
 
-    # 1. Find all script tags
-    script_tags = soup.find_all('script')
+    @staticmethod
+    def string(node):
+        return node.string
 
-    # 2. Iterate through scripts to find the one containing 'var meta = {'
-    for script in script_tags:
-        script_text = script.string
-        if script_text and 'var meta = {' in script_text:
+class LxmlPage:
+    """Product page parsed with lxml.html, queried with the precompiled XPath."""
 
-            # 3. Use regex to reliably extract the JSON content assigned to the 'meta' variable
-            # We look for 'var meta = ' and capture everything up to the first semicolon ';'
-            match = re.search(r'var\s+meta\s*=\s*(\{.*?\});', script_text, re.DOTALL)
+    # An lxml parser must not be used by two threads at once, each thread gets its own
+    _local = threading.local()
 
-            if match:
-                # The captured group is the JSON string
-                json_string = match.group(1).strip()
-                
-                try:
-                    # 4. Parse the JSON string
-                    data = json.loads(json_string)
-
-                    # 5. Navigate the JSON structure to find the SKU
-                    # Assuming the SKU is in the first variant (common for product pages)
-                    if data.get('product') and data['product'].get('variants'):
-                        variants = data['product']['variants']
-                        return variants[0]['sku']
-                        
-                except json.JSONDecodeError as e:
-                    print(f"Error decoding JSON: {e}")
-                    return None
+    def __init__(self, html):
+        self.root = lxml.html.document_fromstring(html.encode('utf-8'), parser=self.parser())
+
+    @classmethod
+    def parser(cls):
+        parser = getattr(cls._local, 'parser', None)
+        if parser is None:
+            parser = cls._local.parser = lxml.html.HTMLParser(encoding='utf-8')
+        return parser
+
+    def find(self, selector, node=None):
+        found = selector.xpath(self.root if node is None else node)
+        return found[0] if found else None
+
+    def find_all(self, selector, node=None):
+        return selector.xpath(self.root if node is None else node)
+
+    @staticmethod
+    def text(node):
+        return ''.join(TEXT_NODES(node))
+
+    @staticmethod
+    def attr(node, name):
+        return node.get(name)
 
-    return None
+    @staticmethod
+    def string(node):
+        return node.text
+
+PARSER_BACKENDS = {'lxml': LxmlPage, 'bs4': SoupPage}
+
+def parse_html(html):
+    """Parse a product page once with the PARSER_BACKEND parser."""
+    return PARSER_BACKENDS[PARSER_BACKEND](html)
+
+PRODUCT_NAME = Selector(NAME, "//h1[@class='product__title ff-heading fs-heading-2-base']")
+PRODUCT_MEDIA = Selector('div[class="media media--has-lightbox"]', "//div[@class='media media--has-lightbox']")
+PRODUCT_DESC = Selector(DESC, "//div[@id='description']")
+PRODUCT_PRICE = Selector('span[data-price]', "//span[@data-price]")
+PRODUCT_COMPARE_PRICE = Selector('s[data-compare-price]', "//s[@data-compare-price]")
+VARIANTS_WRAPPER = Selector(
+    "div[class='product__controls-group product__variants-wrapper product__block product__block--medium']",
+    "//div[@class='product__controls-group product__variants-wrapper product__block product__block--medium']"
+)
+FIRST_IMG = Selector('img', "descendant::img[1]")
+
+# The `var meta = {...};` assignment Shopify renders into every product page
+SHOPIFY_META = re.compile(r'var\s+meta\s*=\s*(\{.*?\});', re.DOTALL)
+
+class ShopifyMeta:
+    """
+    Product variants from a page's Shopify meta blob, parsed once per page.
+    Each variant has its SKU, price and barcode and is looked up by
+    public_title (the option value shown on the page) or by SKU.
+    """
+
+    def __init__(self, variants=()):
+        self.variants = [{
+            'public_title': v.get('public_title') or "",
+            'sku': v.get('sku'),
+            'price': format_shopify_price(v.get('price')),
+            'barcode': v.get('barcode') or v.get('sku'),
+        } for v in variants]
+        self.by_title = {}
+        self.by_sku = {}
+        for v in self.variants:
+            self.by_title.setdefault(v['public_title'], v)
+            if v['sku']:
+                self.by_sku.setdefault(v['sku'], v)
+
+    @classmethod
+    def from_html(cls, html):
+        for match in SHOPIFY_META.finditer(html or ""):
+            try:
+                data = json.loads(match.group(1).strip())
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON: {e}")
+                return cls()
+            variants = (data.get('product') or {}).get('variants')
+            if variants:
+                return cls(variants)
+        return cls()
+
+    def variant(self, var_name):
+        """Variant titled var_name, else the first one whose title contains it."""
+        found = self.by_title.get(var_name)
+        if found is None:
+            found = next((v for v in self.variants if var_name in v['public_title']), None)
+        return found
+
+    def sku(self, var_name=None):
+        """SKU of the var_name variant, or of the first variant without one."""
+        found = self.variant(var_name) if var_name is not None else next(iter(self.variants), None)
+        return found['sku'] if found else None
 
 
  
@@ -698,22 +322,6 @@ def get_urls_csv(csv_file):
     print(product_urls[1])
     return product_urls
     
-# Webdriver settings
-def setup_driver():
-    # Settings
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    options.add_argument('--window-size=1920,1080')
-    options.add_argument('--incognito')
-    # User agent
-    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36')
-        
-    driver = webdriver.Chrome(options=options)
-    return driver
-
 def handle_cookie_banner(driver, timeout=5):
     """Checks for and clicks the cookie consent banner if present."""
     try:
@@ -742,6 +350,28 @@ def handle_cookie_banner(driver, timeout=5):
         print(f"An error occurred while handling the cookie banner: {e}")
         return False
 
+# What a variant click changes on the product page
+VARIANT_PRICE = (By.CSS_SELECTOR, 'span[data-price]')
+SELECTED_OPTION = (By.CSS_SELECTOR, 'span[data-selected-value-for-option]')
+OPTION_SELECT = (By.CSS_SELECTOR, 'select[id="option1"]')
+OPTION_ITEMS = (By.CSS_SELECTOR, 'select[id="option1"] option')
+
+def variant_state(driver):
+    return element_text(driver, VARIANT_PRICE), element_text(driver, SELECTED_OPTION), driver.current_url
+
+def wait_for_variant(driver, state):
+    """
+    After a variant click: waits for the price, the selected option value or
+    the ?variant= URL to move away from state, then for the DOM to settle.
+    """
+    price, selected, url = state
+    wait_for(driver, EC.any_of(
+        text_changed(VARIANT_PRICE, price),
+        text_changed(SELECTED_OPTION, selected),
+        EC.url_changes(url)
+    ))
+    wait_for(driver, dom_settled())
+
 # Get category page source
 
 
@@ -750,40 +380,71 @@ def fetch_cat_page(url, driver):
     wait = WebDriverWait(driver, 50)
     try:
         wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.footer__inner")))
-        time.sleep(2)
+        wait_for(driver, page_settled())
         return driver.page_source
     except Exception as e:
         print(f"Error fetching URL")
         return None
 
 
-def fetch_item_page(url, driver):
+# Reads the product links added to a listing since the last call (items come in
+# DOM order, so only the ones past arguments[1] are new), then scrolls the last
+# item into view to load the next batch. Also returns the activity mark taken
+# just before the scroll, for the settle waits that follow it
+HARVEST_LINKS = """
+const items = document.querySelectorAll(arguments[0]);
+const links = [];
+for (let i = arguments[1]; i < items.length; i++) {
+    const link = items[i].querySelector('a');
+    links.push(link ? link.getAttribute('href') : null);
+}
+const since = window.__activity ? performance.now() : null;
+if (items.length) items[items.length - 1].scrollIntoView(true);
+return [links, since];
+"""
+
+def product_count(text):
+    """Expected product count from a collection tile's "42 products" label, None if it has no number."""
+    match = re.search(r"\d+", text.replace(',', '')) if text else None
+    return int(match.group()) if match else None
+
+def harvest_product_links(url, driver, expected=None):
+    """
+    Scrolls an infinite-scroll collection and returns its product hrefs.
+    Each round is a single HARVEST_LINKS call that returns only the new
+    links, so nothing already seen is rescanned. Stops as soon as the
+    collection's expected count is reached. Without a count, a scroll
+    that let the network go quiet and brought nothing new ends the
+    listing; short of the count (or with nothing found at all) it takes
+    HARVEST_EMPTY_ROUNDS such scrolls in a row.
+    """
+    links = []
     try:
         driver.get(url)
-        time.sleep(2)
-        prev_last_product_link = ''
+        wait_for(driver, EC.presence_of_element_located((By.CSS_SELECTOR, ITEM)))
+        empty_rounds = 0
         while True:
-            try:
-                last_product = driver.find_elements(By.CSS_SELECTOR, ITEM)
-                
-                if prev_last_product_link == last_product[-1]:
-                    break
-                
-                print(f'prev: {prev_last_product_link}')
-                print(f'current: {last_product[-1]}')
-                time.sleep(2)
-                driver.execute_script("arguments[0].scrollIntoView(true);", last_product[-1])
-                time.sleep(2)
-                prev_last_product_link = last_product[-1]
-
-                
-            except Exception as e:
-                print(f"PAGIN element not found or not clickable. Proceeding to get page source. {e}")
+            new_links, since = driver.execute_script(HARVEST_LINKS, ITEM, len(links))
+            links.extend(new_links)
+            if expected is not None and len(links) >= expected:
                 break
-        return driver.page_source
+            empty_rounds = 0 if new_links else empty_rounds + 1
+            if empty_rounds >= (1 if expected is None and links else HARVEST_EMPTY_ROUNDS):
+                if expected is not None or not links:
+                    print(f"Listing {url} came up short with {len(links)}{f' of {expected}' if expected is not None else ''} products")
+                break
+            print(f'Collected {len(links)}{f" of {expected}" if expected else ""} products from {url}')
+            # Either the next page of products shows up or the network goes quiet after the scroll
+            wait_for(driver, EC.any_of(
+                element_count_above((By.CSS_SELECTOR, ITEM), len(links)),
+                network_idle(since=since)
+            ))
+            wait_for(driver, dom_settled(since=since))
     except Exception as e:
         print(f"Error fetching URL '{url}': {e}")
-        return None
+        if not links:
+            return None
+    return [link for link in links if link]
 
 def fetch_page(url, driver):
     MAX_RETRIES = 3
@@ -808,13 +469,249 @@ def fetch_page(url, driver):
             print(f"An unexpected error occurred: {e}")
             return None
 
+def format_shopify_price(cents):
+    # Shopify .js endpoints return prices in cents, the storefront shows "$12.00"
+    if cents is None:
+        return ""
+    return f"${cents / 100:,.2f}"
+
+def shopify_image_url(src):
+    if not src:
+        return ""
+    if src.startswith('//'):
+        src = f"https:{src}"
+    src = re.sub(r"[?&]width=\d+", "", src)
+    separator = '&' if '?' in src else '?'
+    return f"{src}{separator}width=1000"
+
+def shopify_product_js_url(url):
+    match = re.search(r"/products/([^/?#]+)", url)
+    if not match:
+        return None
+    return f"https://kbeauty.ca/products/{match.group(1)}.js"
+
+def parse_variant_json(url):
+    """
+    Builds variants_data from the Shopify /products/<handle>.js payload
+    in a single request, without clicking through the variant picker.
+    Returns None if the payload can't be fetched, so the caller can fall
+    back to parse_variant.
+    """
+    json_url = shopify_product_js_url(url)
+    if not json_url:
+        return None
+    try:
+        response = get_http_session().get(json_url, timeout=15)
+        response.raise_for_status()
+        data = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not load variant JSON {json_url}: {e}")
+        return None
+    return variants_from_shopify_js(data)
+
+def variants_from_shopify_js(data):
+    """Maps a Shopify product .js payload to the variants_data dicts parse_variant returns."""
+    options = data.get('options') or []
+    option_name = ""
+    if options:
+        option_name = options[0].get('name', "") if isinstance(options[0], dict) else options[0]
+
+    variants_data = []
+    for i, v in enumerate(data.get('variants') or []):
+        # Sold out variants are crossed out on the page and were never clicked,
+        # only the preselected first one was read
+        if i > 0 and not v.get('available', True):
+            continue
+        image = v.get('featured_image') or {}
+        var_sku = v.get('sku')
+
+        var_to_add = {}
+        var_to_add['cat_name'] = ''
+        var_to_add['Title'] = ''
+        var_to_add['Variant SKU'] = var_sku
+        var_to_add['Image Src'] = shopify_image_url(image.get('src'))
+        var_to_add['Body (HTML)'] = ''
+        var_to_add['Variant Barcode'] = v.get('barcode') or var_sku
+        var_to_add['Variant Image'] = ''
+        var_to_add['Variant Price'] = format_shopify_price(v.get('price'))
+        var_to_add['Variant Compare At Price'] = format_shopify_price(v.get('compare_at_price'))
+        var_to_add['Vendor'] = "KBeauty"
+        var_to_add['Option1 name'] = option_name
+        var_to_add['Option1 value'] = v.get('option1') or v.get('public_title') or "N/A"
+        var_to_add['Handle'] = ''
+        var_to_add['Status'] = ''
+        variants_data.append(var_to_add)
+    return variants_data
+
+def fetch_shopify_json(url, key):
+    """
+    Reads every page of a Shopify listing endpoint (?limit=&page=) and
+    returns the records under key. Returns None if any page fails, so a
+    half-read listing is never taken for the whole one.
+    """
+    records = []
+    page = 1
+    while True:
+        try:
+            response = get_http_session().get(url, params={'limit': SHOPIFY_PAGE_LIMIT, 'page': page}, timeout=15)
+            response.raise_for_status()
+            page_records = response.json().get(key) or []
+        except (requests.RequestException, ValueError, AttributeError) as e:
+            print(f"Could not load {url} page {page}: {e}")
+            return None
+        records.extend(page_records)
+        if len(page_records) < SHOPIFY_PAGE_LIMIT:
+            return records
+        page += 1
+
+def shopify_collections():
+    """All collections of the store as {'url', 'name'}, None if collections.json can't be read."""
+    collections = fetch_shopify_json("https://kbeauty.ca/collections.json", 'collections')
+    if not collections:
+        return None
+    return [{'url': f"https://kbeauty.ca/collections/{collection['handle']}", 'name': collection['title'].strip()} for collection in collections]
+
+def shopify_collection_products(cat_url, name):
+    """
+    Product URL records of one collection from its products.json, the
+    same {'cat', 'url', 'name'} rows url_to_csv writes. None on failure.
+    """
+    products = fetch_shopify_json(f"{cat_url}/products.json", 'products')
+    if products is None:
+        return None
+    return [{'cat': cat_url, 'url': f"https://kbeauty.ca/products/{product['handle']}", 'name': name} for product in products]
+
+# Parse single product data
+def parse_product(doc, meta, cat, url, cat_name):
+    name_el = doc.find(PRODUCT_NAME)
+    if name_el is not None:
+        name = doc.text(name_el).strip()
+
+
+        image_url_el = doc.find_all(PRODUCT_MEDIA)
+        if image_url_el:
+            image_url = []
+            print(f'Found {len(image_url_el)} images')
+
+            for el in image_url_el:
+                img = doc.find(FIRST_IMG, el)
+                if img is not None:
+                    new_url = re.sub(r"&width=.*", "&width=1000", doc.attr(img, 'src'))
+                    new_url = f"https:{new_url}"
+                    image_url.append(new_url)
+            image_url = set(image_url)
+        else:
+            image_url = ""
+
+
+
+        desc_el = doc.find(PRODUCT_DESC)
+        desc = doc.text(desc_el).strip() if desc_el is not None else ""
+
+        sku = meta.sku()
+        #upc = extract_barcode_from_json_script(prod_soup)
+
+        price_el = doc.find(PRODUCT_PRICE)
+        price = doc.text(price_el).strip() if price_el is not None else ""
+
+        compare_price_el = doc.find(PRODUCT_COMPARE_PRICE)
+        compare_price = doc.text(compare_price_el).strip() if compare_price_el is not None else ""
+
+
+        vendor = "KBeauty"
+        name = vendor + ' ' + name 
+
+        return { # Add product data as a single row
+
+            "cat_name": cat_name,
+            "Title": name,
+            "Variant SKU" : sku,
+            "Image Src": image_url,
+            "Body (HTML)": desc,
+            "Variant Barcode": sku,
+            "Variant Image": '',
+            "Variant Price": price,
+            "Variant Compare At Price": compare_price,
+            "Vendor": vendor,
+            "Option1 name": "",
+            "Option1 value": "",
+            "Handle": create_url_handle(name, sku),
+            "Status": 'draft'
+
+        }
+
+def parse_product_page(element, html):
+    """
+    Parses a fetched product page into (product, has_variants), where
+    has_variants tells if the page shows a variant picker. Plain data in
+    and out, so it can run in a parse worker process.
+    """
+    doc = parse_html(html)
+    product = parse_product(doc, ShopifyMeta.from_html(html), element['cat'], element['url'], element['name'])
+    return product, bool(product) and doc.find(VARIANTS_WRAPPER) is not None
+
+def parse_variant_page(html, name_selector):
+    """
+    Reads the selected variant off a product page rendered in Chrome.
+    Plain data in and out, so it can run in a parse worker process; the
+    SKU is left empty for the caller to look up in ShopifyMeta.
+    """
+    var_soup = bs(html, 'lxml')
+
+    if var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]'):
+        image_url_el = var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]')
+        img = image_url_el[0].select_one('img')
+        new_url = re.sub(r"&width=.*", "&width=1000", img.get('src'))
+        var_image_url = f"https:{new_url}"
+    else:
+        var_image_url = ""
+
+    span_element = var_soup.select_one('span[data-selected-value-for-option]')
+    if span_element:
+        option_value = span_element.get_text(strip=True)
+    else:
+        option_value = "N/A"
+
+    option_name = var_soup.select_one(name_selector)
+    if option_name:
+        span_element.decompose()
+        option_name = option_name.get_text(strip=True)
+    else:
+        option_name = "N/A"
+
+    if var_soup.select('span[data-price]'):
+        var_price = var_soup.select_one('span[data-price]').text.strip()
+    else:
+        var_price = ""
+
+    var_compare_price = ""
+    if var_soup.select('s[data-compare-price]'):
+        var_compare_price = var_soup.select_one('s[data-compare-price]').text.strip()
+
+    var_to_add = {}
+    var_to_add['cat_name'] = ''
+    var_to_add['Title'] = ''
+    var_to_add['Variant SKU'] = ''
+    var_to_add['Image Src'] = var_image_url
+    var_to_add['Body (HTML)'] = ''
+    var_to_add['Variant Barcode'] = ''
+    var_to_add['Variant Image'] = ''
+    var_to_add['Variant Price'] = var_price
+    var_to_add['Variant Compare At Price'] = var_compare_price
+    var_to_add['Vendor'] = "KBeauty"
+    var_to_add['Option1 name'] = option_name
+    var_to_add['Option1 value'] = option_value
+    var_to_add['Handle'] = ''
+    var_to_add['Status'] = ''
+    return var_to_add
+
 # Main function that scrape all products
 def scrape_products_all():
     products = []
     
     
     # Create product URL list
-    def get_product_urls(driver, url_count):
+    def get_product_urls(url_count):
         csv_file = CSV
         cat_urls = []
         urls_stats = []
@@ -822,7 +719,23 @@ def scrape_products_all():
         product_urls = []
         if CSV_READY:
             product_urls = get_urls_csv(csv_file)
+            return product_urls, urls_stats
+        collections = shopify_collections() if DISCOVERY_MODE == 'json' else None
+        if collections is not None:
+            collections.append({'url': 'https://kbeauty.ca/collections/makeup-korean', 'name': 'MakeUp'})
+            for cat in collections:
+                urls_to_save = shopify_collection_products(cat['url'], cat['name'])
+                if urls_to_save is None:
+                    print(f"No product list for {cat['url']}")
+                    continue
+                url_count += len(urls_to_save)
+                product_urls.extend(urls_to_save)
+                urls_stats.extend(urls_to_save)
+                print(f'Found {len(product_urls)} products')
+                url_to_csv(urls_to_save)
         else:
+            # Only the browser walk needs Chrome
+            driver = setup_driver()
             page = 1
             while True:
                 html = fetch_cat_page(f"https://kbeauty.ca/collections?page={page}", driver)
@@ -834,109 +747,61 @@ def scrape_products_all():
                     cat_url = cat.get('href')
                     cat_name_el = cat.select_one('div[class="collection-item__meta collection-item__title ff-heading fs-body-100"]')
                     product_count_span = cat.select_one('span.collection-item__product-count')
+                    expected = None
                     if product_count_span:
+                        expected = product_count(product_count_span.get_text())
                         product_count_span.decompose()
                     cat_name = cat_name_el.text.strip() 
-                    cat_urls.append({'type': 'https://kbeauty.ca/collections', 'url': f"https://kbeauty.ca{cat_url}", 'name': cat_name})
+                    cat_urls.append({'type': 'https://kbeauty.ca/collections', 'url': f"https://kbeauty.ca{cat_url}", 'name': cat_name, 'count': expected})
                 page += 1
             for cat in cat_urls:
                 url = cat['url']
-                html = fetch_item_page(url, driver)
-                soup = bs(html, "lxml") if html else print("No page source HTML")
-                prod_el = soup.select(ITEM)
-                for el in prod_el:
+                links = harvest_product_links(url, driver, cat['count'])
+                if links is None:
+                    print("No product links")
+                    links = []
+                for href in links:
                     url_count += 1
-                    product_urls.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': cat['name']})
-                    urls_to_save.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': cat['name']})
-                    urls_stats.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': cat['name']})
+                    product_urls.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': cat['name']})
+                    urls_to_save.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': cat['name']})
+                    urls_stats.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': cat['name']})
                 print(f'Found {len(product_urls)} products')
                 url_to_csv(urls_to_save)
                 urls_to_save = []
             url = 'https://kbeauty.ca/collections/makeup-korean'
-            html = fetch_item_page(url, driver)
-            soup = bs(html, "lxml") if html else print("No page source HTML")
-            prod_el = soup.select(ITEM)
-            for el in prod_el:
-                product_urls.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': 'MakeUp'})
-                urls_to_save.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': 'MakeUp'})
-                urls_stats.append({'cat': url, 'url': f"https://kbeauty.ca{el.select_one('a').get('href')}", 'name': cat['name']})
+            links = harvest_product_links(url, driver)
+            if links is None:
+                print("No product links")
+                links = []
+            for href in links:
+                product_urls.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': 'MakeUp'})
+                urls_to_save.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': 'MakeUp'})
+                urls_stats.append({'cat': url, 'url': f"https://kbeauty.ca{href}", 'name': cat['name']})
             print(f'Found {len(product_urls)} products')
             url_to_csv(urls_to_save)
             urls_to_save = []
+            driver.quit()
         return product_urls, urls_stats
 
-    # Parse single product data
-    def parse_product(prod_soup, cat, url, cat_name):
-            if prod_soup and prod_soup.select_one(NAME):
-                name = prod_soup.select_one(NAME).text.strip()
-                
-
-                if prod_soup.select('div[class="media media--has-lightbox"]'):
-                    time.sleep(1)
-                    image_url_el = []
-                    image_url = []
-                    image_url_el = prod_soup.select('div[class="media media--has-lightbox"]')
-                    print(f'Found {len(image_url_el)} images')
-                    
-                    for el in image_url_el:
-                        if el.select_one('img'):
-                            img = el.select_one('img')  
-                            new_url = re.sub(r"&width=.*", "&width=1000", img.get('src'))
-                            new_url = f"https:{new_url}"
-                            image_url.append(new_url)
-                    image_url = set(image_url)
-                else:
-                    image_url = ""
-
-               
-
-                if prod_soup.select(DESC):
-                    desc = prod_soup.select_one(DESC).text.strip()
-                else:
-                    desc = ""
-
-                sku = extract_sku_from_shopify_meta_no_vars(prod_soup)
-                #upc = extract_barcode_from_json_script(prod_soup)
-                
-                if prod_soup.select('span[data-price]'):
-                    price = prod_soup.select_one('span[data-price]').text.strip()
-                else:
-                    price = ""
-                
-                compare_price = ""
-                if prod_soup.select('s[data-compare-price]'):
-                    compare_price = prod_soup.select_one('s[data-compare-price]').text.strip()
-                
-
-                vendor = "KBeauty"
-                name = vendor + ' ' + name 
-
-                return { # Add product data as a single row
-
-                    "cat_name": cat_name,
-                    "Title": name,
-                    "Variant SKU" : sku,
-                    "Image Src": image_url,
-                    "Body (HTML)": desc,
-                    "Variant Barcode": sku,
-                    "Variant Image": '',
-                    "Variant Price": price,
-                    "Variant Compare At Price": compare_price,
-                    "Vendor": vendor,
-                    "Option1 name": "",
-                    "Option1 value": "",
-                    "Handle": create_url_handle(name, sku),
-                    "Status": 'draft'
-
-                }
     # Parse product variant data if any
     
     def parse_variant(url, driver):
+        # The theme only marks a variant image as loaded once it has downloaded
+        block_resources(driver, [group for group in BLOCK_RESOURCES if group != 'image'])
+        try:
+            return click_variants(url, driver)
+        finally:
+            block_resources(driver)
+
+    def click_variants(url, driver):
         driver.get(url)
 
         variants_data= []
+        # Variant pages handed to submit_parse, the clicking goes on while they are parsed
+        pending = []
         buttons = None
         options = None
+        meta = None
 
         if driver.find_elements(By.CSS_SELECTOR, "div[class='product__controls-group product__variants-wrapper product__block product__block--medium']"):
             var_block = driver.find_elements(By.CSS_SELECTOR, "div[class='product__controls-group product__variants-wrapper product__block product__block--medium']")
@@ -948,59 +813,9 @@ def scrape_products_all():
             print("buttons = ", buttons)
             
             html = driver.page_source
-            var_soup = bs(html, 'lxml')
-
-  
-
-            if var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]'):
-                image_url_el = var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]')
-                img = image_url_el[0].select_one('img')
-                new_url = re.sub(r"&width=.*", "&width=1000", img.get('src'))
-                var_image_url = f"https:{new_url}"
-            else:
-                var_image_url = ""
-
-            span_element = var_soup.select_one('span[data-selected-value-for-option]')
-            if span_element:
-                button_value = span_element.get_text(strip=True)
-            else:
-                button_value = "N/A"
-
-            button_name = var_soup.select_one('label[for="option1"]')
-            if button_name:
-                span_element.decompose()
-                button_name = button_name.get_text(strip=True)
-            else:
-                button_name = "N/A"
-            
-            var_sku = extract_sku_from_shopify_meta(var_soup, button_value)
-            #var_upc = extract_barcode_from_json_script(var_soup)
-                
-            if var_soup.select('span[data-price]'):
-                var_price = var_soup.select_one('span[data-price]').text.strip()
-            else:
-                var_price = ""
-            
-            var_compare_price = ""
-            if var_soup.select('s[data-compare-price]'):
-                var_compare_price = var_soup.select_one('s[data-compare-price]').text.strip()
-
-            var_to_add = {}
-            var_to_add['cat_name'] = ''
-            var_to_add['Title'] = ''
-            var_to_add['Variant SKU'] = var_sku
-            var_to_add['Image Src'] = var_image_url
-            var_to_add['Body (HTML)'] = ''
-            var_to_add['Variant Barcode'] = var_sku
-            var_to_add['Variant Image'] = ''
-            var_to_add['Variant Price'] = var_price
-            var_to_add['Variant Compare At Price'] = var_compare_price
-            var_to_add['Vendor'] = "KBeauty"
-            var_to_add['Option1 name'] = button_name
-            var_to_add['Option1 value'] = button_value
-            var_to_add['Handle'] = ''
-            var_to_add['Status'] = ''
-            variants_data.append(var_to_add)
+            # Same product on every click, so the variant SKUs are read once
+            meta = ShopifyMeta.from_html(html)
+            pending.append(submit_parse(parse_variant_page, html, 'label[for="option1"]'))
            
 
             for i in range(1, len(buttons)):
@@ -1013,70 +828,19 @@ def scrape_products_all():
                 cross = buttons_list[i].find_elements(By.CSS_SELECTOR, "span[class='product__chip-crossed']")
                 
                 if i <= len(buttons_list) and not cross:
+                    state = variant_state(driver)
                     try:
                         buttons_list[i].click()
                     except Exception as e:
                         close = driver.find_elements(By.CSS_SELECTOR, "button[aria-label='Close dialog']")
                         close[0].click()
-                        time.sleep(2)
+                        wait_for(driver, EC.element_to_be_clickable(buttons_list[i]))
                         buttons_list[i].click()
                 
-                    time.sleep(3) 
+                    wait_for_variant(driver, state)
                         
                     html = driver.page_source
-                    var_soup = bs(html, 'lxml')
-
-                    
-
-                    if var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]'):
-                        image_url_el = var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]')
-                        img = image_url_el[0].select_one('img')
-                        new_url = re.sub(r"&width=.*", "&width=1000", img.get('src'))
-                        var_image_url = f"https:{new_url}"
-                    else:
-                        var_image_url = ""
-
-                    span_element = var_soup.select_one('span[data-selected-value-for-option]')
-                    if span_element:
-                        button_value = span_element.get_text(strip=True)
-                    else:
-                        button_value = "N/A"
-
-                    button_name = var_soup.select_one('label[class="product__label fs-body-100"]')
-                    if button_name:
-                        span_element.decompose()
-                        button_name = button_name.get_text(strip=True)
-                    else:
-                        button_name = "N/A"
-                    var_sku = extract_sku_from_shopify_meta(var_soup, button_value)
-                        
-                    #var_upc = extract_barcode_from_json_script(var_soup)
-                            
-                    if var_soup.select('span[data-price]'):
-                        var_price = var_soup.select_one('span[data-price]').text.strip()
-                    else:
-                        var_price = ""
-                        
-                    var_compare_price = ""
-                    if var_soup.select('s[data-compare-price]'):
-                        var_compare_price = var_soup.select_one('s[data-compare-price]').text.strip()
-
-                    var_to_add = {}
-                    var_to_add['cat_name'] = ''
-                    var_to_add['Title'] = ''
-                    var_to_add['Variant SKU'] = var_sku
-                    var_to_add['Image Src'] = var_image_url
-                    var_to_add['Body (HTML)'] = ''
-                    var_to_add['Variant Barcode'] = var_sku
-                    var_to_add['Variant Image'] = ''
-                    var_to_add['Variant Price'] = var_price
-                    var_to_add['Variant Compare At Price'] = var_compare_price
-                    var_to_add['Vendor'] = "KBeauty"
-                    var_to_add['Option1 name'] = button_name
-                    var_to_add['Option1 value'] = button_value
-                    var_to_add['Handle'] = ''
-                    var_to_add['Status'] = ''
-                    variants_data.append(var_to_add)
+                    pending.append(submit_parse(parse_variant_page, html, 'label[class="product__label fs-body-100"]'))
                 else:
                     continue
                         
@@ -1088,7 +852,7 @@ def scrape_products_all():
             try:
                 options_list_el = driver.find_element(By.CSS_SELECTOR, 'select[id="option1"]')
                 options_list_el.click()
-                time.sleep(1)
+                wait_for(driver, EC.presence_of_all_elements_located(OPTION_ITEMS))
                 print('list was opened')
                 options_list = options_list_el.find_elements(By.CSS_SELECTOR, 'option')
                 print(f'Found {len(options_list)} options')
@@ -1111,91 +875,56 @@ def scrape_products_all():
                                 print("Page did not refresh as expected.")
 
                             html = driver.page_source
-                            var_soup = bs(html, 'lxml')
-
-                            
-                            print('check 2')
-                            if var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]'):
-                                image_url_el = var_soup.select('div[class="image aspect-ratio--square animation--image animation--lazy-load loaded"]')
-                                img = image_url_el[0].select_one('img')
-                                new_url = re.sub(r"&width=.*", "&width=1000", img.get('src'))
-                                var_image_url = f"https:{new_url}"
-                            else:
-                                var_image_url = ""
-
-                            span_element = var_soup.select_one('span[data-selected-value-for-option]')
-                            if span_element:
-                                option_value = span_element.get_text(strip=True)
-                            else:
-                                option_value = "N/A"
-
-                            option_name = var_soup.select_one('label[class="product__label fs-body-100"]')
-                            if option_name:
-                                span_element.decompose()
-                                option_name = option_name.get_text(strip=True)
-                            else:
-                                option_name = "N/A"
-                                
-                            var_sku = extract_sku_from_shopify_meta(var_soup, option_value)
-                            #var_upc = extract_barcode_from_json_script(var_soup)
-                                    
-                            print('check 3')
-                            if var_soup.select('span[data-price]'):
-                                var_price = var_soup.select_one('span[data-price]').text.strip()
-                            else:
-                                var_price = ""
-                                
-                            var_compare_price = ""
-                            if var_soup.select('s[data-compare-price]'):
-                                var_compare_price = var_soup.select_one('s[data-compare-price]').text.strip()
-
-                            print('check 4')
-                            var_to_add = {}
-                            var_to_add['cat_name'] = ''
-                            var_to_add['Title'] = ''
-                            var_to_add['Variant SKU'] = var_sku
-                            var_to_add['Image Src'] = var_image_url
-                            var_to_add['Body (HTML)'] = ''
-                            var_to_add['Variant Barcode'] = var_sku
-                            var_to_add['Variant Image'] = ''
-                            var_to_add['Variant Price'] = var_price
-                            var_to_add['Variant Compare At Price'] = var_compare_price
-                            var_to_add['Vendor'] = "Vendor"
-                            var_to_add['Option1 name'] = option_name
-                            var_to_add['Option1 value'] = option_value
-                            var_to_add['Handle'] = ''
-                            var_to_add['Status'] = ''
-                            variants_data.append(var_to_add)
+                            if meta is None:
+                                meta = ShopifyMeta.from_html(html)
+                            pending.append(submit_parse(parse_variant_page, html, 'label[class="product__label fs-body-100"]'))
                         except:
                             print("No option click")
 
                         # Open option list
                         if i != len(options_list) - 1:
-                            time.sleep(1)
+                            wait_for(driver, EC.element_to_be_clickable(OPTION_SELECT))
                             try:
                                 options_list_el = driver.find_element(By.CSS_SELECTOR, 'select[id="option1"]')
                                 options_list_el.click()
                                 print('list was opened')
                             except:
                                 print("No options list click")
+
+        for future in pending:
+            try:
+                var_to_add = future.result()
+            except Exception as e:
+                print(f"Error parsing variant of {url}: {e}")
+                continue
+            var_sku = meta.sku(var_to_add['Option1 value'])
+            var_to_add['Variant SKU'] = var_sku
+            var_to_add['Variant Barcode'] = var_sku
+            variants_data.append(var_to_add)
         return variants_data
 
-    driver = setup_driver()
     url_count = 0
     product_count = 0
+    unchanged_count = 0
     stats = []
     prod_stats = []
-    open(PROD_DEBUG_FILE, 'w', encoding='utf-8').close()
-
 
-    product_urls, urls_stats = get_product_urls(driver, url_count)
+    journal = CrawlJournal(JOURNAL_FILE)
+    if journal.unfinished():
+        product_urls = journal.remaining()
+        urls_stats = []
+        print(f"Resuming interrupted run, {len(product_urls)} products left")
+    else:
+        open(PROD_DEBUG_FILE, 'w', encoding='utf-8').close()
+        product_urls, urls_stats = get_product_urls(url_count)
+        journal.start(product_urls)
 
     conn = None
     try:
         # 1. Establish the database connection
         conn = psycopg2.connect(**DB_CONFIG)
         conn.autocommit = False  # Start a transaction
-        cursor = conn.cursor()
+        writer = ProductWriter(conn, VENDOR_COLUMN, VENDOR_VALUE)
         print('check1')
     except (Exception, psycopg2.Error) as error:
         print(f"Database Error: {error}", file=sys.stderr)
@@ -1204,57 +933,158 @@ def scrape_products_all():
         sys.exit(1)
     
 
-    # Parse product page
-    for element in product_urls:
-        cat = element['cat']
+    # Parse a fetched product page, returns the product and whether it has a variant picker
+    def parse_page(element, prod_html):
+        journal.fetched(element, prod_html)
+        product, has_variants = submit_parse(parse_product_page, element, prod_html).result()
+        journal.mark([element], 'parsed')
+        return product, has_variants
+
+    # Fetch and parse a single product page on one of the pool workers
+    def scrape_product(element, get_driver):
         url = element['url']
-        name = element['name']
         print(f'Parsing product {url}')
-        db_status =  ''
-        product_id = ''     
-        prod_html = fetch_page(url, driver)
+        prod_html = fetch_page_http(url, STATIC_PAGE_MARKERS, validators=journal.validators(element)) if FETCH_MODE == 'http' else None
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html:
+            prod_html = fetch_page(url, get_driver())
+        if not prod_html:
+            return None
+        product, has_variants = parse_page(element, prod_html)
+
+        # None - no variant block on the page, [] - block found but no variants parsed
+        variants = None
+        if has_variants:
+            variants = parse_variant_json(url)
+            if variants is None:
+                variants = parse_variant(url, get_driver())
+        return product, variants
+
+    # Same as scrape_product for the async crawler; returns None to send the page to Chrome
+    async def scrape_product_async(element, fetch):
+        url = element['url']
+        print(f'Parsing product {url}')
+        prod_html = await fetch(url, journal.validators(element))
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html or not all(marker in prod_html for marker in STATIC_PAGE_MARKERS):
+            return None
+        product, has_variants = await asyncio.to_thread(parse_page, element, prod_html)
+
+        variants = None
+        if has_variants:
+            payload = await fetch(shopify_product_js_url(url))
+            if not payload:
+                return None
+            variants = variants_from_shopify_js(json.loads(payload))
+        return product, variants
+
+    # Pipeline stages, each takes the previous stage's payload and passes on
+    # what it does not handle (NOT_MODIFIED, None) untouched
+    drivers = None
+
+    def fetch_stage(element, _):
+        url = element['url']
+        print(f'Fetching product {url}')
+        prod_html = fetch_page_http(url, STATIC_PAGE_MARKERS, validators=journal.validators(element)) if FETCH_MODE == 'http' else None
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html:
+            prod_html = drivers.run(lambda get_driver: fetch_page(url, get_driver()), url)
         if prod_html:
-            prod_soup = bs(prod_html, "lxml")
-        if prod_soup:
-            product = parse_product(prod_soup, cat, url, name)
-        
+            journal.fetched(element, prod_html)
+        return prod_html or None
+
+    def parse_stage(element, prod_html):
+        if not isinstance(prod_html, str):
+            return prod_html
+        parsed = get_parse_pool().submit(parse_product_page, element, prod_html).result()
+        journal.mark([element], 'parsed')
+        return parsed
+
+    def variants_stage(element, parsed):
+        if not isinstance(parsed, tuple):
+            return parsed
+        product, has_variants = parsed
+        variants = None
+        if has_variants:
+            url = element['url']
+            variants = parse_variant_json(url)
+            if variants is None:
+                variants = drivers.run(lambda get_driver: parse_variant(url, get_driver()), url)
+        return product, variants
 
-        else:
-            debug_message = f"Product {url} from {cat} is empty\n"
-            print(f"WARNING: {debug_message.strip()}")
-            with open(PROD_DEBUG_FILE, 'a', encoding='utf-8') as prod_debug_file:
-                prod_debug_file.write(debug_message)
-            continue
+    # Parse product page
+    if CRAWL_MODE == 'async':
+        crawled = crawl_products_async(product_urls, scrape_product_async, scrape_product)
+    elif CRAWL_MODE == 'pipeline':
+        # Chrome only fetches what plain HTTP could not, so the pool stays at DRIVER_WORKERS
+        drivers = DriverPool(DRIVER_WORKERS)
+        crawled = crawl_pipeline(product_urls, [
+            ('fetch', fetch_stage, FETCH_WORKERS),
+            ('parse', parse_stage, PARSE_WORKERS),
+            ('variants', variants_stage, DRIVER_WORKERS),
+        ])
+    else:
+        crawled = crawl_products(product_urls, scrape_product)
 
-        if not product:
-            continue 
-        
-        if prod_soup.select("div[class='product__controls-group product__variants-wrapper product__block product__block--medium']"):
-            
-            variants = parse_variant(url, driver)
-            if len(variants) > 0:
-                product['Variant SKU'] = ''
-                product['Variant Price'] = ''
-                product['Variant Compare At Price'] = ''
-                product["Option1 name"] = variants[0]['Option1 name']
-                for variant in variants:
-                    variant['Option1 name'] = ""
-                    variant['Handle'] = product['Handle']
-        
-                product_to_save = [product]
-                product_to_save.extend(variants)
-                variants_list = variants
-                print(variants_list)
-                db_status, product_id = upsert_product_data(product, variants_list, cursor)
-                conn.commit()
-        else:
-            product_to_save = [product]
-            db_status, product_id = upsert_product_data(product, [], cursor)
-            conn.commit()
-       
-        product_count += 1
-        prod_stats.append({'url': url, 'status': db_status, 'product_id': product_id, 'product_count': product_count})
-    
+    def record(results):
+        nonlocal product_count, unchanged_count
+        for element, db_status, product_id in results:
+            if db_status == UNCHANGED_STATUS:
+                unchanged_count += 1
+                continue
+            product_count += 1
+            prod_stats.append({'url': element['url'], 'status': db_status, 'product_id': product_id, 'product_count': product_count})
+        journal.mark([element for element, db_status, _ in results if db_status == UNCHANGED_STATUS], 'unchanged')
+        journal.mark([element for element, db_status, _ in results if db_status and db_status != UNCHANGED_STATUS], 'upserted')
+        journal.mark([element for element, db_status, _ in results if not db_status], 'skipped')
+
+    # Closing the crawl stops its threads if the loop ends early
+    with closing(crawled):
+        for element, scraped in crawled:
+            cat = element['cat']
+            url = element['url']
+            if scraped is None:
+                debug_message = f"Product {url} from {cat} is empty\n"
+                print(f"WARNING: {debug_message.strip()}")
+                with open(PROD_DEBUG_FILE, 'a', encoding='utf-8') as prod_debug_file:
+                    prod_debug_file.write(debug_message)
+                continue
+
+            # The fields hash is always computed so the next incremental run has one to compare with
+            # Unchanged products are not written again, only marked as seen in the DB
+            if scraped is NOT_MODIFIED or (journal.unchanged(element, scraped) and INCREMENTAL):
+                record(writer.add_unchanged(element))
+                continue
+
+            product, variants = scraped
+            if not product:
+                journal.mark([element], 'skipped')
+                continue
+
+            if variants is not None:
+                if len(variants) > 0:
+                    product['Variant SKU'] = ''
+                    product['Variant Price'] = ''
+                    product['Variant Compare At Price'] = ''
+                    product["Option1 name"] = variants[0]['Option1 name']
+                    for variant in variants:
+                        variant['Option1 name'] = ""
+                        variant['Handle'] = product['Handle']
+                    record(writer.add(element, product, variants))
+                else:
+                    record([(element, '', '')])
+            else:
+                record(writer.add(element, product, []))
+
+    record(writer.close())
+    if drivers is not None:
+        drivers.close()
+    journal.finish()
+    if INCREMENTAL:
+        print(f"{unchanged_count} products unchanged since the last run")
     debug(urls_stats, prod_stats)
     stats.append({
         'product_count': product_count,
@@ -1265,7 +1095,6 @@ def scrape_products_all():
     prod_stats_df = pd.DataFrame(prod_stats)
     prod_stats_df.to_csv('../data/kbeauty_prod_stats.csv', index=False)
 
-    driver.quit()
     if conn:
         conn.close()
         print("Database connection closed.")
@@ -4,8 +4,11 @@ import psycopg2
 import csv
 import sys
 import os
+import heapq
+from operator import itemgetter
 from datetime import datetime
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 from dotenv import load_dotenv
 from typing import List, Dict, Any
 
@@ -34,6 +37,25 @@ DB_CONFIG = {
 # Define table names
 PRODUCT_TABLE = "product_db"
 VARIANT_TABLE = "variant_db"
+# variant_db column the export is scoped to VENDOR by
+VARIANT_VENDOR_COLUMN = "debug_1"
+
+# Variant rows fetched per round trip from the server-side export cursor,
+# the output CSVs are appended to after every batch
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 10000))
+
+# Variant statuses read by the export. UNCHANGED variants (found unchanged
+# by an incremental crawl) are live and up to date: neither exported nor drafted
+TARGET_STATUSES = ('UPD', 'NEW', 'EXIST', 'NOT_READY')
+UNCHANGED_STATUS = 'UNCHANGED'
+
+# Status of the exported variants afterwards: written by the last crawl -> EXIST,
+# EXIST (not seen by any crawl since the last export) -> NOT_READY
+STATUS_TRANSITIONS = {
+    'EXIST': 'NOT_READY', # Change EXIST to NOT_READY
+    'UPD':   'EXIST',     # Change UPD to EXIST
+    'NEW':   'EXIST'      # Change NEW to EXIST
+}
 
 # Output folder setup
 OUTPUT_DIR = "../data"
@@ -133,15 +155,70 @@ def create_url_handle(title, sku=None):
     return handle_title
 
 
-def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_columns: List[str]):
+def expand_image_rows(df):
     """
-    Converts a list of dictionaries into a DataFrame, renames and 
-    reorders columns, and saves it to a CSV file.
+    Splits the comma separated 'Image Src' into one row per image URL.
+    The first URL stays on the original row, every other URL gets a row
+    of its own with only 'Handle' and 'Image Src' set, the way Shopify
+    imports additional product images. Rows without any URL are kept as is.
+    """
+    urls = df['Image Src'].astype(str).str.split(',').explode().str.strip()
+    has_url = (urls != '').to_numpy()
+    row_has_url = pd.Series(has_url, index=urls.index).groupby(level=0).transform('any').to_numpy()
+    # One row per URL, or the first (empty) part for rows without URLs
+    keep = has_url | (~row_has_url & ~urls.index.duplicated())
+    urls, row_has_url = urls[keep], row_has_url[keep]
+
+    expanded = df.loc[urls.index].reset_index(drop=True)
+    expanded.loc[row_has_url, 'Image Src'] = urls.to_numpy()[row_has_url]
+
+    # Blank out everything but Handle and Image Src on the extra image rows
+    first_url = ~urls.index.duplicated()
+    extra_cols = expanded.columns.difference(['Handle', 'Image Src'], sort=False)
+    expanded[extra_cols] = expanded[extra_cols].astype(object)
+    expanded.loc[~first_url, extra_cols] = None
+    return expanded.infer_objects()
+
+def merge_single_variants(df):
+    """
+    Folds the variant row into its product row for handles that have a
+    product row (Title set) and exactly one variant row (SKU set, no
+    Title): the variant's non-empty VARIANT_COLS_TO_MERGE are copied onto
+    the product row and the variant row is dropped. Handles with several
+    or no variants are left as they are. Rows come out grouped by Handle,
+    sorted, with the merged product row first; rows without a Handle are
+    dropped.
+    """
+    df = df[df['Handle'].notna()]
+    handles = df['Handle']
+    is_product = df['Title'].notna()
+    is_variant = df['Variant SKU'].notna() & df['Title'].isna()
+
+    # Handles with a product row and exactly one variant row
+    variant_count = is_variant.groupby(handles).transform('sum')
+    has_product = is_product.groupby(handles).transform('any')
+    merge = (variant_count == 1) & has_product
+    merged_product = merge & is_product & ~handles.where(is_product).duplicated()
+    merged_variant = merge & is_variant
+
+    # One join: variant values by handle onto the product rows
+    variant_values = df.loc[merged_variant].set_index('Handle')[VARIANT_COLS_TO_MERGE]
+    variant_values = variant_values.reindex(handles[merged_product]).set_axis(df.index[merged_product])
+    df = df.astype({col: object for col in VARIANT_COLS_TO_MERGE})
+    df.loc[merged_product, VARIANT_COLS_TO_MERGE] = variant_values.where(
+        variant_values.notna(), df.loc[merged_product, VARIANT_COLS_TO_MERGE]
+    )
+
+    df = df[~merged_variant].assign(_merged_first=~merged_product[~merged_variant])
+    df = df.sort_values(['Handle', '_merged_first'], kind='stable').drop(columns='_merged_first')
+    return df.reset_index(drop=True).infer_objects()
+
+def prepare_frame(data_list: List[Dict[str, Any]]):
+    """
+    Row-level part of the export transformation: rename, reorder and
+    price cleanup. Done once per batch for the rows of all output files
+    together.
     """
-    if not data_list:
-        print(f"No data to save for {filename}")
-        return
-    
     # 1. Convert list of dictionaries to a DataFrame
     df = pd.DataFrame(data_list)
     #print(df)
@@ -162,6 +239,18 @@ def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_
     columns_to_clean = ['Variant Price', 'Variant Compare At Price', 'Cost per item']
         
     df[columns_to_clean] = df[columns_to_clean].replace("nan", "").replace("None", "").replace("N/A", "")
+    return df
+
+
+def save_frame(df, filename: str, append: bool = False):
+    """
+    File-level part of the export transformation: variant handles, image
+    rows and the single variant merge, which depend on which rows end up
+    in the file. Saves the result to filename, appending without a header
+    if append is set.
+    """
+    row_count = len(df)
+    df = df.reset_index(drop=True)
 
     
     for i in range(len(df)):
@@ -171,6 +260,8 @@ def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_
 
    
     
+    # Filled in for the variants below; created up front so every batch has the same columns
+    df['Variant Handle'] = pd.Series(np.nan, index=df.index, dtype=object)
     parent_indices = df[df['is_variant_parent'] == True].index
     for idx in parent_indices:
         title = df.loc[idx, 'Title']
@@ -213,27 +304,7 @@ def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_
     df.loc[standalone_mask, 'Handle'] = new_handles[standalone_mask]
         
     
-    expanded_rows = []
-    for index, row in df.iterrows():
-        urls_str = str(row['Image Src'])
-        urls = [url.strip() for url in urls_str.split(',') if url.strip()]
-        current_url_handle = row['Handle']
-
-        if not urls:
-            expanded_rows.append(row.to_dict())
-            continue
-
-        first_url_row = row.copy()
-        first_url_row['Image Src'] = urls[0]
-        expanded_rows.append(first_url_row.to_dict())
-
-        for i in range(1, len(urls)):
-            new_row_data = {col: None for col in df.columns}
-            new_row_data['Image Src'] = urls[i]
-            new_row_data['Handle'] = current_url_handle
-            
-            expanded_rows.append(new_row_data)
-    df = pd.DataFrame(expanded_rows)
+    df = expand_image_rows(df)
     df['Variant Barcode'] = df['Variant Barcode'].astype(str).str.replace("UPC ", "", regex=False)
     df['Variant Image'] = df['Variant Image'].replace("nan", "").replace("None", "").replace("N/A", "")
     df['Image Src'] = df['Image Src'].replace("nan", "").replace("None", "").replace("N/A", "")
@@ -243,81 +314,240 @@ def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_
     'Handle'
     ] = df['Variant Handle']
 
-    processed_rows = []
-    
-    # 1. Group by Handle
-    grouped = df.groupby('Handle')
-    
-    for handle, group in grouped:
-        # Identify the main product row (Title is not null)
-        product_rows = group[group['Title'].notna()]
-        
-        # Identify valid variant rows (SKU is not null)
-        variant_rows = group[
-            df['Variant SKU'].notna() & # Has a SKU/Variant SKU value
-            df['Title'].isna()    # Title is null (Confirms it's a child/variant row)
-        ]
-        
-        # Identify the single main product row (should only be one)
-        # We take the first one found, if any.
-        main_product_row_idx = product_rows.index[0] if not product_rows.empty else None
-        
-        # --- LOGIC FOR SINGLE VARIANT MERGE ---
-        
-        # Check for exactly one variant AND a corresponding product row
-        if len(variant_rows) == 1 and main_product_row_idx is not None:
-            # Found a product with exactly one variant: MERGE
-            
-            variant_row_idx = variant_rows.index[0]
-            
-            # Get data for merging
-            variant_data = df.loc[variant_row_idx, VARIANT_COLS_TO_MERGE].to_dict()
-            
-            # Get the product row dictionary for modification
-            product_row_dict = df.loc[main_product_row_idx].to_dict()
-            
-            # Copy variant data to the product row
-            # This is where the merge happens. We check for non-null values 
-            # from the variant row to ensure we only overwrite if data exists.
-            for col, value in variant_data.items():
-                if pd.notna(value):
-                    product_row_dict[col] = value
-                
-            # 1. Append the modified (merged) product row
-            processed_rows.append(product_row_dict)
-            
-            # 2. Append all auxiliary/image rows ("other rows")
-            
-            # Identify the indices of the product and variant row that are now replaced
-            # We use a list for indices to drop from the group
-            indices_to_remove = [main_product_row_idx, variant_row_idx]
-            
-            # Drop the product and single variant row from the group to get the remaining auxiliary rows
-            # 'errors=ignore' handles cases where an index might not be in the group (though it should be)
-            auxiliary_rows_df = group.drop(index=indices_to_remove, errors='ignore')
-            
-            # Append these auxiliary rows to the processed_rows list
-            for _, aux_row in auxiliary_rows_df.iterrows():
-                processed_rows.append(aux_row.to_dict())
-                    
-        else:
-            # --- LOGIC FOR MULTIPLE VARIANTS, ZERO VARIANTS, OR MISSING PRODUCT ROW ---
-            # Append all original rows in the group unchanged (as requested).
-            
-            # Append all rows from the current group, maintaining original order
-            for idx in group.index:
-                processed_rows.append(df.loc[idx].to_dict())
+    df = merge_single_variants(df)
 
 
-    # Create the final DataFrame from the processed rows
-    df = pd.DataFrame(processed_rows)
-    df= df.reset_index(drop=True)
+    # 4. Save to CSV
+    df.to_csv(filename, mode='a' if append else 'w', index=False, header=not append)
+    print(f"Successfully saved {row_count} rows to {filename}")
 
 
-    # 4. Save to CSV
-    df.to_csv(filename, index=False, header=True)
-    print(f"Successfully saved {len(data_list)} rows to {filename}")
+def process_and_save_data(data_list: List[Dict[str, Any]], filename: str, final_columns: List[str], append: bool = False):
+    """
+    Converts a list of dictionaries into a DataFrame, renames and 
+    reorders columns, and saves it to a CSV file.
+    With append=True the rows are added to the end of an existing
+    file, without a header.
+    """
+    if not data_list:
+        print(f"No data to save for {filename}")
+        return
+    save_frame(prepare_frame(data_list), filename, append)
+
+
+
+PRODUCT_EXPORT_COLUMNS = [
+    'product_id', 'cat', 'url', 'cat_name', 'title', 'sku', 'image_url', 'descr', 'cert', 'opt_1', 'opt_2',
+    'opt_3', 'tags', 'product_category', 'type', 'vendor', 'inventory_tracker',
+    'inventory_quantity', 'debug_1', 'debug_2', 'debug_3', 'handle', 'status'
+]
+
+VARIANT_EXPORT_COLUMNS = [
+    'var_id', 'product_id', 'handle', 'var_image_url', 'sku', 'opt_1_val', 'opt_2_val', 'opt_3_val',
+    'price', 'cost', 'compare', 'upc', 'weight', 'weight_grams', 'published', 'status_int',
+    'debug_1', 'debug_2', 'debug_3'
+]
+
+
+def merge_sorted_runs(runs, filename, key='Handle'):
+    """
+    Merges CSV files that are each sorted by the key column into filename,
+    streaming row by row. Rows with equal keys keep the order of the runs,
+    like the stable sort of a single write. The runs are removed.
+    """
+    files = [open(run, newline='', encoding='utf-8') for run in runs]
+    try:
+        readers = [csv.reader(file) for file in files]
+        header = [next(reader) for reader in readers][0]
+        column = header.index(key)
+        with open(filename, 'w', newline='', encoding='utf-8') as output:
+            # The dialect DataFrame.to_csv writes with
+            writer = csv.writer(output, lineterminator=os.linesep)
+            writer.writerow(header)
+            writer.writerows(heapq.merge(*readers, key=itemgetter(column)))
+    finally:
+        for file in files:
+            file.close()
+    for run in runs:
+        os.remove(run)
+
+
+class ExportFile:
+    """
+    Output CSV written in batches: rows are collected with add(), each
+    batch write_export_batch hands to write() is saved as a run file
+    (sorted by Handle, like every save_frame output) and finish() merges
+    the runs into the file. The file comes out in the same order as if
+    all of its rows had gone through save_frame at once.
+    save_frame hands variants the handle of the product row above them,
+    so take() keeps the last product row and everything after it for
+    the next batch.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.rows = []
+        self.runs = []
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def take(self, final=False):
+        """Rows ready to be written; on the final batch all of them."""
+        split = len(self.rows)
+        if not final:
+            split = max((i for i, row in enumerate(self.rows) if 'title' in row), default=0)
+        rows, self.rows = self.rows[:split], self.rows[split:]
+        return rows
+
+    def write(self, df):
+        run = f"{self.filename}.{len(self.runs)}.part"
+        save_frame(df, run)
+        self.runs.append(run)
+
+    def finish(self):
+        if not self.runs:
+            print(f"No data to save for {self.filename}")
+        elif len(self.runs) == 1:
+            os.replace(self.runs[0], self.filename)
+        else:
+            merge_sorted_runs(self.runs, self.filename)
+            print(f"Merged {len(self.runs)} batches into {self.filename}")
+        self.runs = []
+
 
+def write_export_batch(export_files, final=False):
+    """
+    Runs prepare_frame once over the pending rows of all output files,
+    then writes each file's slice of the shared frame.
+    """
+    batches = [(export_file, export_file.take(final)) for export_file in export_files]
+    batches = [(export_file, rows) for export_file, rows in batches if rows]
+    if batches:
+        df = prepare_frame([row for _, rows in batches for row in rows])
+        start = 0
+        for export_file, rows in batches:
+            export_file.write(df.iloc[start:start + len(rows)])
+            start += len(rows)
+
+
+def iter_export_products(conn, statuses):
+    """
+    Streams the variants to export together with their product row from
+    a named (server-side) cursor, EXPORT_BATCH_SIZE rows per round trip.
+    Rows are ordered by product_id, so (parent_row, variant_rows) can be
+    yielded per product without holding the whole result in memory.
+    Statuses and vendor are bound parameters, the statement text is the
+    same for every run and every vendor size.
+    """
+    export_query = sql.SQL("""
+        SELECT {}, {}
+        FROM {} v
+        JOIN {} p ON p.product_id = v.product_id
+        WHERE v.status_int = ANY(%s) AND v.{} = %s
+        ORDER BY v.product_id, v.sku
+    """).format(
+        sql.SQL(', ').join(sql.Identifier('p', col) for col in PRODUCT_EXPORT_COLUMNS),
+        sql.SQL(', ').join(sql.Identifier('v', col) for col in VARIANT_EXPORT_COLUMNS),
+        sql.Identifier(VARIANT_TABLE),
+        sql.Identifier(PRODUCT_TABLE),
+        sql.Identifier(VARIANT_VENDOR_COLUMN)
+    )
+    split = len(PRODUCT_EXPORT_COLUMNS)
+
+    with conn.cursor(name='export_rows') as export_cursor:
+        export_cursor.itersize = EXPORT_BATCH_SIZE
+        export_cursor.execute(export_query, (list(statuses), VENDOR))
+        parent_row, variants = None, []
+        for row in export_cursor:
+            if parent_row is None or row[0] != parent_row['product_id']:
+                if parent_row is not None:
+                    yield parent_row, variants
+                parent_row, variants = dict(zip(PRODUCT_EXPORT_COLUMNS, row[:split])), []
+            variants.append(dict(zip(VARIANT_EXPORT_COLUMNS, row[split:])))
+        if parent_row is not None:
+            yield parent_row, variants
+
+
+def export_products(products, separated_data, draft_data, archive, on_batch, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Splits the (parent_row, variant_rows) products into the output files
+    of their status (draft_data for any status without a file of its own)
+    and writes a batch every batch_size variants, always on a product
+    boundary, then finishes the files. The archive file gets a copy of the
+    rows of the exported statuses. on_batch is called with the
+    (var_id, status_int) pairs of every batch written.
+    Returns the number of variants exported.
+    """
+    export_files = [*separated_data.values(), draft_data, archive]
+    exported_variants = []
+    variant_count = 0
+    batch_rows = 0
+
+    # Iterate over products (to ensure parent row comes first)
+    for parent_row, variants in products:
+
+        # 1. DETERMINE PARENT STATUS FROM VARIANTS
+        parent_status = 'EXIST' # Set a safe default status (e.g., 'EXIST' for products already known)
+
+        # --- ALL VARIANTS ARE NEW ---
+        if all(v.get('status_int') == 'NEW' for v in variants):
+            parent_status = 'NEW'
+
+        # --- ANY VARIANT IS UPDATED ---
+        # Only check for UPD if the status wasn't already determined as NEW
+        elif any(v.get('status_int') == 'UPD' for v in variants):
+            parent_status = 'UPD'
+
+        # --- 2. PROCESS AND SAVE PARENT ROW ---
+        parent_row['status_int'] = parent_status
+        parent_row['sku'] = ''
+        separated_data.get(parent_status, draft_data).add(parent_row)
+        if parent_status in ['UPD', 'NEW', 'EXIST']:
+            archive.add(parent_row)
+
+        # --- 3. PROCESS AND SAVE VARIANT ROWS ---
+        for variant_row in variants:
+            variant_row['var_img'] = parent_row['image_url']
+            variant_status = variant_row['status_int']
+            separated_data.get(variant_status, draft_data).add(variant_row)
+            exported_variants.append((variant_row['var_id'], variant_status))
+            if variant_status in ['UPD', 'NEW', 'EXIST']:
+                archive.add(variant_row)
+
+        # --- 4. Append the batch to the output CSVs (always on a product boundary) ---
+        variant_count += len(variants)
+        batch_rows += len(variants)
+        if batch_rows >= batch_size:
+            write_export_batch(export_files)
+            on_batch(exported_variants)
+            exported_variants = []
+            batch_rows = 0
+
+    write_export_batch(export_files, final=True)
+    on_batch(exported_variants)
+    for export_file in export_files:
+        export_file.finish()
+    return variant_count
+
+
+def save_exported_variants(cursor, rows):
+    """Adds (var_id, status_int) pairs to the exported_variants temp table."""
+    if rows:
+        execute_values(cursor, "INSERT INTO exported_variants (var_id, status_int) VALUES %s", rows, page_size=len(rows))
+
+
+def reset_unchanged_variants(cursor):
+    """
+    Moves the vendor's UNCHANGED variants back to EXIST once an export is
+    done, so the next export drafts them unless a crawl sees them again.
+    """
+    reset_query = sql.SQL("UPDATE {} SET status_int = 'EXIST' WHERE status_int = %s AND {} = %s").format(
+        sql.Identifier(VARIANT_TABLE), sql.Identifier(VARIANT_VENDOR_COLUMN)
+    )
+    cursor.execute(reset_query, (UNCHANGED_STATUS, VENDOR))
+    if cursor.rowcount:
+        print(f"Updated {cursor.rowcount} variants from '{UNCHANGED_STATUS}' to 'EXIST'.")
 
 
 def export_and_manage_data():
@@ -329,73 +559,19 @@ def export_and_manage_data():
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     archive_filename = os.path.join(ARCHIVE_DIR, f"archive_copy_{timestamp}.csv")
-    
-
-    TARGET_STATUSES = ('UPD', 'NEW', 'EXIST', 'NOT_READY')
 
     try:
         conn = psycopg2.connect(**DB_CONFIG)
         conn.autocommit = False 
         cursor = conn.cursor()
 
+        # Variants written to the CSVs, the status transitions are applied to exactly these rows
+        cursor.execute(sql.SQL("""
+            CREATE TEMP TABLE exported_variants ON COMMIT DROP AS
+            SELECT var_id, status_int FROM {} WITH NO DATA
+        """).format(sql.Identifier(VARIANT_TABLE)))
 
-
-        variant_select_query = sql.SQL("""
-            SELECT 
-                var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                price, cost, compare, upc, weight, weight_grams, published, status_int, 
-                debug_1, debug_2, debug_3
-            FROM {} 
-            WHERE status_int IN {} AND debug_1 = {}
-            ORDER BY product_id, sku;
-        """).format(
-            sql.Identifier(VARIANT_TABLE),
-            sql.Literal(TARGET_STATUSES),
-            sql.Literal(VENDOR)
-        )
-
-        cursor.execute(variant_select_query)
-        variant_rows_tuples = cursor.fetchall()
-        
-        if not variant_rows_tuples:
-            print("No relevant variant data found for export. Exiting.")
-            sys.exit(0)
-
-        variant_cols = [desc[0] for desc in cursor.description]
-        
-        # --- Group variants by product_id and build the set of product IDs needed ---
-        variants_by_product = {}
-        product_ids_to_fetch = set()
-        
-        for row_tuple in variant_rows_tuples:
-            row_dict = dict(zip(variant_cols, row_tuple))
-            pid = row_dict['product_id']
-            product_ids_to_fetch.add(pid)
-            if pid not in variants_by_product:
-                variants_by_product[pid] = []
-            variants_by_product[pid].append(row_dict)
-
-
-        # --- STEP 2: Fetch corresponding Product data ---
-        product_select_query = sql.SQL("""
-            SELECT 
-                product_id, cat, url, cat_name, title, sku, image_url, descr, cert, opt_1, opt_2, 
-                opt_3, tags, product_category, type, vendor, inventory_tracker, 
-                inventory_quantity, debug_1, debug_2, debug_3, handle, status
-            FROM {} 
-            WHERE product_id IN ({})
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.SQL(', ').join(map(sql.Literal, list(product_ids_to_fetch)))
-        )
-        
-        cursor.execute(product_select_query)
-        product_rows_tuples = cursor.fetchall()
-        product_cols = [desc[0] for desc in cursor.description]
-        product_data_map = {row[0]: dict(zip(product_cols, row)) for row in product_rows_tuples}
-
-        
-        # --- STEP 3: Restructure Data for Hierarchical Export ---
+        # --- STEP 1-3: Stream products with their variants and split them by status ---
         
         STATUS_MAP = {
             "UPD": f"{WEBSITE}_upd_for_shopify.csv",
@@ -403,138 +579,56 @@ def export_and_manage_data():
             # All other statuses will be grouped into 'to_draft'
         }
         
-        separated_data = {key: [] for key in STATUS_MAP.keys()}
-        draft_data = []
-        archive_rows = []
-        
-        # Define the complete, unified header row for the CSV files
-        # Includes all unique columns from both product and variant tables
-        ALL_COLUMNS = list(set(product_cols) | set(variant_cols))
-        
-        # Iterate over products (to ensure parent row comes first)
-        for pid in product_ids_to_fetch:
-    
-            if pid not in product_data_map:
-                continue # Skip if product data wasn't fetched (shouldn't happen)
-                
-            # --- Get Parent Data ---
-            parent_row = product_data_map[pid]
-            parent_written = False 
-            
-            # 1. NEW LOGIC: DETERMINE PARENT STATUS FROM VARIANTS
-            parent_status = 'EXIST' # Set a safe default status (e.g., 'EXIST' for products already known)
-            
-            if pid in variants_by_product:
-                variants = variants_by_product[pid]
-
-                # --- NEW RULE: ALL VARIANTS ARE NEW ---
-                # Check if the list of variants is non-empty AND 
-                # all variants have the status 'NEW'
-                if variants and all(v.get('status_int') == 'NEW' for v in variants):
-                    parent_status = 'NEW'
-                    
-                # --- PREVIOUS RULE: ANY VARIANT IS UPDATED ---
-                # Only check for UPD if the status wasn't already determined as NEW
-                elif any(v.get('status_int') == 'UPD' for v in variants):
-                    parent_status = 'UPD'
-                
-                # Now, proceed to iterate through the variants
-                for variant_row in variants:
-                    variant_row['var_img'] = parent_row['image_url']
-                    # --- 1. PROCESS AND SAVE PARENT ROW (Executed only once per PID) ---
-                    if not parent_written:
-                        
-                        # A. Separate for Output Files
-                        if parent_status in STATUS_MAP:
-                            # Save the raw product data
-                            parent_row['status_int'] = parent_status
-                            separated_data[parent_status].append(parent_row)
-                            parent_row['sku'] = ''
-                        else:
-                            parent_row['status_int'] = parent_status
-                            parent_row['sku'] = ''
-                            draft_data.append(parent_row)
-                            
-                        # B. Prepare Archive Copy 
-                        if parent_status in ['UPD', 'NEW', 'EXIST']:
-                            archive_rows.append(tuple(parent_row.get(col, None) for col in ALL_COLUMNS))
-                        
-                        parent_written = True # Mark parent as saved
-
-                    # --- 2. PROCESS AND SAVE VARIANT ROW (Executed for every variant) ---
-                    variant_status = variant_row['status_int'] # This is still correct for variants
-                    
-                    # A. Separate for Output Files
-                    if variant_status in STATUS_MAP:
-                        # Save the raw variant data
-                        separated_data[variant_status].append(variant_row)
-                    else:
-                        draft_data.append(variant_row)
-                        
-                    # B. Prepare Archive Copy 
-                    if variant_status in ['UPD', 'NEW', 'EXIST']:
-                        archive_rows.append(tuple(variant_row.get(col, None) for col in ALL_COLUMNS))
+        separated_data = {key: ExportFile(os.path.join(OUTPUT_DIR, filename)) for key, filename in STATUS_MAP.items()}
+        draft_data = ExportFile(os.path.join(OUTPUT_DIR, "to_draft.csv"))
+
+        # The archive copy goes through the same frame as the output files
+        archive = ExportFile(archive_filename)
 
-        
-        
-        # --- STEP 4: Write Output CSVs and Archive ---
-        
-        # a. Write UPD and NEW files
         print("\n--- Exporting CSV Files ---")
-        for status, filename in STATUS_MAP.items():
-            filename = os.path.join(OUTPUT_DIR, filename)
-            process_and_save_data(separated_data[status], filename, FINAL_COLUMNS)
+        variant_count = export_products(
+            iter_export_products(conn, TARGET_STATUSES), separated_data, draft_data, archive,
+            lambda rows: save_exported_variants(cursor, rows)
+        )
 
-        # b. Write TO_DRAFT file
-        d_filename = os.path.join(OUTPUT_DIR, "to_draft.csv")
-        process_and_save_data(draft_data, d_filename, FINAL_COLUMNS)
-            
-        # c. Write Archive Copy
-        # NOTE: Archive is saved using ALL_COLUMNS list and tuples, not dicts, so we use it raw.
-        # We pass ALL_COLUMNS as the final argument for the header/reindex in the helper.
-        a_filename = os.path.basename(archive_filename)
-        a_filename = os.path.join(ARCHIVE_DIR, a_filename) 
-        process_and_save_data(archive_rows, a_filename, ALL_COLUMNS)
+        # --- STEP 4: Variants the crawl found unchanged go back to EXIST ---
+        reset_unchanged_variants(cursor)
+
+        if not variant_count:
+            conn.commit()
+            print("No relevant variant data found for export. Exiting.")
+            sys.exit(0)
 
         
         
-        # --- STEP 5: Update Statuses in Database (Using variant_rows_tuples for consistency) ---
+        # --- STEP 5: Update Statuses in Database (only the exported variants, one statement) ---
         print("\n--- Updating Statuses in DB ---")
         
-        STATUS_TRANSITIONS = {
-            'EXIST': 'NOT_READY', # Change EXIST to NOT_READY
-            'UPD':   'EXIST',     # Change UPD to EXIST
-            'NEW':   'EXIST'      # Change NEW to EXIST
-        }
-        
-        # Collect all SKUs that were exported (keyed by current status)
-        skus_by_status = {status: [] for status in TARGET_STATUSES}
-        for row_tuple in variant_rows_tuples:
-            row_dict = dict(zip(variant_cols, row_tuple))
-            status = row_dict['status_int']
-            skus_by_status[status].append(row_dict['sku'])
-
+        # Rows whose status changed since they were exported are left alone
+        transition_query = sql.SQL("""
+            WITH updated AS (
+                UPDATE {} v
+                SET status_int = CASE e.status_int {} END
+                FROM exported_variants e
+                WHERE v.var_id = e.var_id
+                AND v.status_int = e.status_int
+                AND e.status_int = ANY(%s)
+                RETURNING e.status_int
+            )
+            SELECT status_int, count(*) FROM updated GROUP BY status_int
+        """).format(
+            sql.Identifier(VARIANT_TABLE),
+            sql.SQL(' ').join(
+                sql.SQL("WHEN {} THEN {}").format(sql.Literal(old_status), sql.Literal(new_status))
+                for old_status, new_status in STATUS_TRANSITIONS.items()
+            )
+        )
         
-        # Iterate through transitions and apply updates
+        cursor.execute(transition_query, (list(STATUS_TRANSITIONS),))
+        updated_counts = dict(cursor.fetchall())
         for old_status, new_status in STATUS_TRANSITIONS.items():
-            skus_to_update = skus_by_status.get(old_status)
-            
-            if skus_to_update:
-                update_query = sql.SQL("""
-                    UPDATE {}
-                    SET status_int = {}
-                    WHERE sku IN ({})
-                    AND status_int  = {}
-                """).format(
-                    sql.Identifier(VARIANT_TABLE),
-                    sql.Literal(new_status),
-                    sql.SQL(', ').join(map(sql.Literal, skus_to_update)),
-                    sql.Literal(old_status)
-                )
-                
-                cursor.execute(update_query)
-                print(f"Updated {cursor.rowcount} variants from '{old_status}' to '{new_status}'.")
-        
+            if old_status in updated_counts:
+                print(f"Updated {updated_counts[old_status]} variants from '{old_status}' to '{new_status}'.")
         
         # --- STEP 6. Commit and Cleanup ---
         conn.commit()
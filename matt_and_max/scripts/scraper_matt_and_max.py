@@ -1,6 +1,8 @@
 import re
 import json
 from bs4 import BeautifulSoup as bs
+import lxml.html
+from lxml import etree
 import pandas as pd
 import time
 from pandas.core.methods.describe import describe_numeric_1d
@@ -14,6 +16,10 @@ from selenium.common.exceptions import ElementClickInterceptedException, StaleEl
 import csv
 import os
 import itertools
+import threading
+from contextlib import closing
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 import psycopg2
 from psycopg2 import sql, extras
@@ -39,13 +45,42 @@ DB_CONFIG = {
     "port": DB_PORT
 }
 
+# Crawl infrastructure shared by the scrapers, reads its settings from the env loaded above
+sys.path.insert(0, os.path.join(script_dir, '..', '..', 'common'))
+from crawl_common import (
+    activity_mark, crawl_pipeline, crawl_products, crawl_products_async, CrawlJournal, dom_settled,
+    DRIVER_WORKERS, DriverPool, element_count_above, fetch_page_http, FETCH_WORKERS, get_parse_pool,
+    INCREMENTAL, network_idle, NOT_MODIFIED, page_settled, PARSE_PROCESSES, PARSE_WORKERS,
+    ProductWriter, submit_parse, UNCHANGED_STATUS, wait_for
+)
+
 
 # TRUE - IF URL LIST .CSV FILE IS READY
 CSV_READY = True
+
+# Chrome drivers loading the category listing pages side by side during discovery
+DISCOVERY_WORKERS = int(os.getenv("DISCOVERY_WORKERS", 4))
+
+# http - plain keep-alive HTTP request first, Chrome only for pages that need JS
+# selenium - always render product pages in Chrome
+FETCH_MODE = os.getenv("FETCH_MODE", "http")
+
+# pool - product pages go through the Chrome driver pool (crawl_products)
+# async - asyncio HTTP crawler (crawl_products_async), Chrome only as a fallback
+# pipeline - bounded-queue stages (crawl_pipeline): fetch threads, parse processes, DB sink
+CRAWL_MODE = os.getenv("CRAWL_MODE", "pool")
+
+# lxml - product pages are parsed once by lxml.html and read with precompiled XPath
+# bs4 - BeautifulSoup with the CSS selectors
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "lxml")
+
 CSV = '../data/matt_and_max_url.csv'
 PROD_DEBUG_FILE = '../data/debug_matt_and_max.log'
 URL_DEBUG_FILE = '../data/debug_matt_and_max_url.log'
 
+# Per-URL crawl state, lets an interrupted run resume where it stopped
+JOURNAL_FILE = '../data/matt_and_max_journal.sqlite'
+
 
 URL_1 = "https://www.matandmax.com/ca-en/products/tools/brushes"  # Product list page
 URL_2 = "https://www.matandmax.com/ca-en/products/tools/combs"  # Product list page
@@ -110,502 +145,20 @@ CERT_BLOCK = ".section.specs.primary-bg"
 
 
 
-headers = {
-    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/134.0.0.0 Safari/537.36",
-    "Accept-Language": "en-US,en;q=0.5",
-    "Referer": "https://google.com",
-    "DNT": "0"
-}
-
-PRODUCT_TABLE = 'product_db'
-VARIANT_LOOKUP_TABLE = 'variant_db'
-
-# Note: I am assuming the connection and transaction (conn) is managed by the caller,
-# and this function only executes queries and does NOT manage the connection itself.
-
-def prepare_data_for_sql(value: Any) -> Optional[Union[str, int, float, bool]]:
-    """
-    Standardizes Python values for safe insertion into PostgreSQL via psycopg2.
-    1. Converts sets and lists (of primitives) to comma-separated strings.
-    2. Converts empty strings ("") to None (SQL NULL).
-    3. Returns None for None.
-    """
-    if value is None:
-        return None
-    
-    # 1. Handle collections (sets and lists) by converting them to strings
-    if isinstance(value, (set, list)):
-        # Join list/set items into a comma-separated string
-        try:
-            # Use map(str, value) to ensure all items are strings before joining
-            return ", ".join(map(str, value))
-        except Exception as e:
-            # Fallback if the collection contains complex, unjoinable objects
-            print(f"Warning: Could not stringify collection {value}. Error: {e}. Sending NULL.")
-            return None
-
-    # 2. Handle empty strings (crucial for numeric fields like price)
-    if isinstance(value, str) and value.strip() == "":
-        return None # Translates to SQL NULL
-    
-    # 3. Handle other types (int, float, bool, non-empty str, etc.)
-    return value
-
-def upsert_single_variant(
-    product_data: Dict[str, Any], 
-    target_sku: str, 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-    target_sku = str(target_sku)
-    # A. LOOKUP by SKU
-    select_query = sql.SQL("SELECT product_id FROM {} WHERE sku = {}").format(
-        sql.Identifier(PRODUCT_TABLE),
-        sql.Literal(target_sku)
-    )
-    cursor.execute(select_query)
-    result = cursor.fetchone()
-    product_id = result[0] if result else None
-    
-    db_status = None
-    image_urls: List[str] = product_data.get('Image Src', [])
-    image_urls = list(image_urls)
-    if image_urls:
-        product_data['var_img'] = product_data.get('Image Src', [])
-    else:
-        product_data['var_img'] = ""
-
-    # --- B. UPDATE LOGIC (If product_id exists - Rule 2) ---
-    if product_id:
-        status_to_set = 'UPD'
-        db_status = 'UPD'
-
-        # 1. Product Table UPDATE
-        update_product_query = sql.SQL("""
-            UPDATE {}
-            SET 
-                cat = {}, url = {}, cat_name = {}, title = {}, sku = {}, image_url = {}, 
-                descr = {}, cert = {}, opt_1 = {}, opt_2 = {}, opt_3 = {}, tags = {}, 
-                product_category = {}, type = {}, vendor = {}, inventory_tracker = {}, 
-                inventory_quantity = {}, debug_1 = {}, debug_2 = {}, debug_3 = {},
-                handle = {}, status_int = {}, status = {} 
-            WHERE product_id = {}
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))), 
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant SKU", None))), # Use Variant SKU for product.sku
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))), 
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(product_id)
-        )
-        cursor.execute(update_product_query)
-
-
-
-        # 2. Variant Table UPSERT (for the single variant, using target_sku as var_id)
-        upsert_variant_query = sql.SQL("""
-            INSERT INTO {} (
-                var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                price, cost, compare, upc, weight, weight_grams, published, status_int, 
-                debug_1, debug_2, debug_3, vendor
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-            )
-            ON CONFLICT (var_id) DO UPDATE SET 
-                var_image_url = EXCLUDED.var_image_url,
-                price = EXCLUDED.price, 
-                cost = EXCLUDED.cost, 
-                compare = EXCLUDED.compare,
-                upc = EXCLUDED.upc, 
-                weight = EXCLUDED.weight, 
-                published = EXCLUDED.published,
-                status_int = EXCLUDED.status_int,
-                debug_1 = EXCLUDED.debug_1,  -- ADDED THIS
-                debug_2 = EXCLUDED.debug_2,  -- ADDED THIS
-                debug_3 = EXCLUDED.debug_3,  -- ADDED THIS
-                vendor = EXCLUDED.vendor;    -- ADDED THIS
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            # Variant VALUES (using single product_data dict)
-            sql.Literal(target_sku), 
-            sql.Literal(product_id),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("var_img", None))),
-            sql.Literal(prepare_data_for_sql(target_sku)),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Price", None))),        # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("cost", None))),         # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Compare At Price", None))),      # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Barcode", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight", None))),       # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("weight_grams", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("published", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None)))
-        )
-        cursor.execute(upsert_variant_query)
-
-        
-        
-    # --- C. INSERT LOGIC (If product_id does NOT exist - Rule 1) ---
-    else:
-        status_to_set = 'NEW'
-        db_status = 'NEW'
-        
-        # 1. Product Table INSERT (RETURNING product_id)
-        insert_product_query = sql.SQL("""
-            INSERT INTO {} (
-                cat, url, cat_name, title, sku, image_url, descr, cert, opt_1, opt_2, opt_3, 
-                tags, product_category, type, vendor, inventory_tracker, inventory_quantity, 
-                debug_1, debug_2, debug_3, handle, status, status_int
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}
-            )
-            RETURNING product_id;
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant SKU", None))), # Use Variant SKU for product.sku
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))), # IMPORTANT: Use None for numeric
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(status_to_set)
-        )
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0] 
-        
-        # 2. Variant Table INSERT (for the single variant)
-        insert_variant_query = sql.SQL("""
-            INSERT INTO {} (
-                var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val,
-                price, cost, compare, upc, weight, weight_grams, published, status_int,
-                debug_1, debug_2, debug_3, vendor
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-            );
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            sql.Literal(target_sku),
-            sql.Literal(product_id),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("var_img", None))),
-            sql.Literal(prepare_data_for_sql(target_sku)),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 value", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Price", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cost", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Compare At Price", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Variant Barcode", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("weight_grams", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("published", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None)))
-        )
-        cursor.execute(insert_variant_query)
-
-        
-
-    return db_status, product_id
-
-# --- HELPER FUNCTION 2: Multi-Variant Logic (Rules 3 & 4) ---
-
-def upsert_multi_variant(
-    product_data: Dict[str, Any], 
-    variants: List[Dict[str, Any]], 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-
-    # A. LOOKUP by Handle
-    variant_skus = [v.get("Variant SKU") for v in variants if v.get("Variant SKU")]
-
-    product_id = None
-    
-    if variant_skus:
-        # 2. Build the WHERE var_id IN (...) clause from the list of SKUs
-        print(len(variant_skus))
-        sku_literals = sql.SQL(', ').join(sql.Literal(sku) for sku in variant_skus)
-        
-        select_query = sql.SQL("""
-            SELECT product_id 
-            FROM {} 
-            WHERE var_id IN ({})
-            LIMIT 1
-        """).format(
-            sql.Identifier(VARIANT_LOOKUP_TABLE),
-            sku_literals
-        )
-        
-        cursor.execute(select_query)
-        result = cursor.fetchone()
-        product_id = result[0] if result else None
-    
-    db_status = None
-
-    # --- UPD PATH (Rule 3: Product exists, Update product and variants) ---
-    if product_id:
-        status_to_set = 'UPD'
-        db_status = 'UPD'
-
-        # 1. Update Product Table
-        update_product_query = sql.SQL("""
-            UPDATE {} SET 
-                cat = {}, url = {}, cat_name = {}, title = {}, image_url = {}, 
-                descr = {}, cert = {}, opt_1 = {}, opt_2 = {}, opt_3 = {}, 
-                tags = {}, product_category = {}, type = {}, vendor = {}, 
-                inventory_tracker = {}, inventory_quantity = {}, debug_1 = {}, 
-                debug_2 = {}, debug_3 = {}, status_int = {}, status = {}, handle = {}
-            WHERE product_id = {}
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))), 
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(product_id)
-            
-        )
-        cursor.execute(update_product_query)
+# Server-rendered HTML must contain all of these for parse_product to work without JS
+STATIC_PAGE_MARKERS = ('application/ld+json', 'overflow-x-hidden')
 
-        # 2. Loop and UPSERT Variants (Update existing, Insert new)
-        for variant in variants:
-            var_sku = variant.get("Variant SKU")
-            if not var_sku:
-                print(f"Warning: Variant  is missing SKU. Skipping.")
-                continue
+# Column and value that mark this scraper's rows in product_db / variant_db
+VENDOR_COLUMN = 'debug_1'
+VENDOR_VALUE = 'Matt and Max'
 
-            upsert_variant_query = sql.SQL("""
-                INSERT INTO {} (
-                    var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                    price, cost, compare, upc, weight, weight_grams, published, status, 
-                    debug_1, debug_2, debug_3, vendor
-                )
-                VALUES (
-                    {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-                )
-                ON CONFLICT (var_id) DO UPDATE SET 
-                    var_image_url = EXCLUDED.var_image_url,
-                    price = EXCLUDED.price, cost = EXCLUDED.cost, compare = EXCLUDED.compare,
-                    upc = EXCLUDED.upc, weight = EXCLUDED.weight, published = EXCLUDED.published,
-                    status = EXCLUDED.status, debug_1 = EXCLUDED.debug_1, debug_2 = EXCLUDED.debug_2,
-                    debug_3 = EXCLUDED.debug_3;
-            """).format(
-                sql.Identifier(VARIANT_LOOKUP_TABLE),
-                sql.Literal(var_sku),
-                sql.Literal(product_id),
-                sql.Literal(prepare_data_for_sql(variant.get("Handle", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Image Src", None))),
-                sql.Literal(var_sku),
-                sql.Literal(prepare_data_for_sql(variant.get("Option1 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option2 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option3 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("cost", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Compare At Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Barcode", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight_grams", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("published", None))),
-                sql.Literal(status_to_set),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_1", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_2", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_3", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Vendor", None)))
-            )
-            cursor.execute(upsert_variant_query)
-
-            
-
-    # --- NEW PATH (Rule 4: Product does NOT exist, Insert everything) ---
-    else:
-        status_to_set = 'NEW'
-        db_status = 'NEW'
-
-        # 1. Product Table INSERT (RETURNING product_id)
-        insert_product_query = sql.SQL("""
-            INSERT INTO {} (
-                cat, url, cat_name, title, image_url, descr, cert, opt_1, opt_2, opt_3, 
-                tags, product_category, type, vendor, inventory_tracker, inventory_quantity, 
-                debug_1, debug_2, debug_3, handle, status_int, status
-            )
-            VALUES (
-                {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}, {}, 
-                {}, {}, {}, {}, {}
-            )
-            RETURNING product_id;
-        """).format(
-            sql.Identifier(PRODUCT_TABLE),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("url", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cat_name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Title", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Image Src", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Body (HTML)", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("cert", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option1 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option2 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Option3 name", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("tags", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("product_category", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("type", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Vendor", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_tracker", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("inventory_quantity", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_1", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_2", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("debug_3", None))),
-            sql.Literal(prepare_data_for_sql(product_data.get("Handle", None))),
-            sql.Literal(status_to_set),
-            sql.Literal(prepare_data_for_sql(product_data.get("Status", None)))
-        )
-
-
-        cursor.execute(insert_product_query)
-        product_id = cursor.fetchone()[0] 
-        
-        # 2. Loop and INSERT Variants
-        for variant in variants:
-            var_sku = variant.get("Variant SKU")
-            if not var_sku:
-                print(f"Warning: Variant is missing SKU. Skipping.")
-                continue
-
-            insert_variant_query = sql.SQL("""
-                INSERT INTO {} (
-                    var_id, product_id, handle, var_image_url, sku, opt_1_val, opt_2_val, opt_3_val, 
-                    price, cost, compare, upc, weight, weight_grams, published, status_int, 
-                    debug_1, debug_2, debug_3, vendor
-                )
-                VALUES (
-                    {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}, {}
-                );
-            """).format(
-                sql.Identifier(VARIANT_LOOKUP_TABLE),
-                sql.Literal(var_sku),
-                sql.Literal(product_id),
-                sql.Literal(prepare_data_for_sql(variant.get("Handle", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Image Src", None))),
-                sql.Literal(var_sku),
-                sql.Literal(prepare_data_for_sql(variant.get("Option1 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option2 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Option3 value", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("cost", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Compare At Price", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Variant Barcode", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("weight_grams", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("published", None))),
-                sql.Literal(status_to_set),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_1", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_2", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("debug_3", None))),
-                sql.Literal(prepare_data_for_sql(variant.get("Vendor", None)))
-            )
-            cursor.execute(insert_variant_query)
-
-            
-            
-    return db_status, product_id
-
-# --- MAIN DISPATCHER FUNCTION ---
-
-def upsert_product_data(
-    product_data: Dict[str, Any], 
-    variants: List[Dict[str, Any]], 
-    cursor
-) -> Tuple[Optional[str], Optional[int]]:
-    """
-    DISPATCHER: Routes data to the single-variant or multi-variant handler.
-    """
-    print(product_data)
-    print(variants)
-    # --- Multi-Variant Product ---
-    if variants:
-        target_sku = variants[0].get("Variant SKU")
-        if not target_sku:
-            print("Error: Single-variant product is missing 'Variant SKU'. Aborting.")
-            return None, None
-            
-        return upsert_multi_variant(product_data, variants, cursor)
-
-    # --- Single-Variant Product ---
-    else:
-        target_sku = product_data.get("Variant SKU")
-        if not target_sku:
-            print("Error: Single-variant product is missing 'Variant SKU'. Aborting.")
-            return None, None
-            
-        return upsert_single_variant(product_data, target_sku, cursor)
+class MattAndMaxWriter(ProductWriter):
+    """ProductWriter for parse_product's fields: the image is a single URL string, the SKU may be a number."""
 
+    def single_variant_row(self, product_data):
+        variant = dict(product_data)
+        variant['Image Src'] = product_data.get('Image Src') or ""
+        return str(product_data.get("Variant SKU")), variant
 
 def debug(urls_stats, prod_stats):
 
@@ -640,6 +193,130 @@ def create_url_handle(title, sku=None):
         return f"{handle_title}_{handle_sku}"
     return handle_title
 
+def css_class(*names):
+    """XPath predicate for a CSS .class selector."""
+    return ' and '.join(f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')" for name in names)
+
+class Selector:
+    """
+    A CSS selector with its XPath equivalent compiled once at import, so
+    both parser backends run the same query. XPath starting with
+    'descendant::' is relative to the node it is evaluated on, like
+    select_one() on a Tag.
+    """
+
+    def __init__(self, css, xpath):
+        self.css = css
+        self.xpath = etree.XPath(xpath, smart_strings=False)
+
+# Text nodes that BeautifulSoup's .text keeps (it leaves out script and style)
+TEXT_NODES = etree.XPath("descendant::text()[not(parent::script or parent::style)]", smart_strings=False)
+
+class SoupPage:
+    """Product page parsed with BeautifulSoup, queried with the CSS selectors."""
+
+    def __init__(self, html):
+        self.root = bs(html, "lxml")
+
+    def find(self, selector, node=None):
+        return (self.root if node is None else node).select_one(selector.css)
+
+    def find_all(self, selector, node=None):
+        return (self.root if node is None else node).select(selector.css)
+
+    @staticmethod
+    def text(node):
+        return node.text
+
+    @staticmethod
+    def attr(node, name):
+        return node.get(name)
+
+    @staticmethod
+    def string(node):
+        return node.string
+
+    @staticmethod
+    def markup(node):
+        return str(node)
+
+class LxmlPage:
+    """Product page parsed with lxml.html, queried with the precompiled XPath."""
+
+    # An lxml parser must not be used by two threads at once, each thread gets its own
+    _local = threading.local()
+
+    def __init__(self, html):
+        self.root = lxml.html.document_fromstring(html.encode('utf-8'), parser=self.parser())
+
+    @classmethod
+    def parser(cls):
+        parser = getattr(cls._local, 'parser', None)
+        if parser is None:
+            parser = cls._local.parser = lxml.html.HTMLParser(encoding='utf-8')
+        return parser
+
+    def find(self, selector, node=None):
+        found = selector.xpath(self.root if node is None else node)
+        return found[0] if found else None
+
+    def find_all(self, selector, node=None):
+        return selector.xpath(self.root if node is None else node)
+
+    @staticmethod
+    def text(node):
+        return ''.join(TEXT_NODES(node))
+
+    @staticmethod
+    def attr(node, name):
+        return node.get(name)
+
+    @staticmethod
+    def string(node):
+        return node.text
+
+    @staticmethod
+    def markup(node):
+        # Serialized by bs4 from the element's own HTML, so both backends store
+        # the description exactly as str() of the bs4 Tag has it
+        fragment = bs(lxml.html.tostring(node, encoding='unicode', with_tail=False), "lxml")
+        return str(fragment.body.find(True, recursive=False))
+
+PARSER_BACKENDS = {'lxml': LxmlPage, 'bs4': SoupPage}
+
+def parse_html(html):
+    """Parse a product page once with the PARSER_BACKEND parser."""
+    return PARSER_BACKENDS[PARSER_BACKEND](html)
+
+PRODUCT_BLOCK = Selector(
+    "div.flex-1.min-w-0.min-h-0.overflow-x-hidden",
+    f"//div[{css_class('flex-1', 'min-w-0', 'min-h-0', 'overflow-x-hidden')}]"
+)
+PRODUCT_NAME = Selector(NAME, "descendant::h1[1]")
+PRODUCT_BRAND = Selector("h2", "descendant::h2[1]")
+PRODUCT_IMAGE = Selector(IMAGE, f"//div[{css_class('flex', 'justify-center', 'items-center', 'w-full', 'h-full')}]")
+FIRST_IMG = Selector("img", "descendant::img[1]")
+LD_JSON = Selector('script[type="application/ld+json"]', "//script[@type='application/ld+json']")
+PRODUCT_DESC = Selector(DESC, f"descendant::div[{css_class('customer-service')}][1]")
+SIDE_MENU = Selector("ul.side-menu", f"//ul[{css_class('side-menu')}]")
+ACTIVE_LINKS = Selector("a.active", f"descendant::a[{css_class('active')}]")
+PRICE_BLOCK = Selector(
+    "div.font-body.tracking-normal.antialiased.mt-2",
+    f"descendant::div[{css_class('font-body', 'tracking-normal', 'antialiased', 'mt-2')}][1]"
+)
+PRICE = Selector("span", "descendant::span[1]")
+COMPARE_PRICE = Selector("del", "descendant::del[1]")
+VIDEO_BLOCK = Selector("div[class='md:mr-8']", "descendant::div[@class='md:mr-8'][1]")
+UPC_BLOCK = Selector(
+    'div[class="font-navigation uppercase tracking-tight sm:tracking-widest mt-2 mb-4 text-2xs sm:text-xs md:text-3xs xl:text-sm"]',
+    "//div[@class='font-navigation uppercase tracking-tight sm:tracking-widest mt-2 mb-4 text-2xs sm:text-xs md:text-3xs xl:text-sm']"
+)
+UPC = Selector("div", "descendant::div[1]")
+VENDOR = Selector(
+    'h2[class="font-navigation uppercase font-bold text-xl sm:text-2xl md:text-xl xl:text-2xl tracking-widest leading-tight"]',
+    "//h2[@class='font-navigation uppercase font-bold text-xl sm:text-2xl md:text-xl xl:text-2xl tracking-widest leading-tight']"
+)
+
 def extract_sku_from_shopify_meta(soup, var_name):
     """
     Locates the Shopify meta script tag and uses a regex to extract the SKU.
@@ -714,22 +391,6 @@ def get_urls_csv(csv_file):
     print(product_urls[1])
     return product_urls
     
-# Webdriver settings
-def setup_driver():
-    # Settings
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--no-sandbox')
-    options.add_argument('--disable-dev-shm-usage')
-    options.add_argument('--window-size=1920,1080')
-    options.add_argument('--incognito')
-    # User agent
-    options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36')
-        
-    driver = webdriver.Chrome(options=options)
-    return driver
-
 def handle_cookie_banner(driver, timeout=5):
     """Checks for and clicks the cookie consent banner if present."""
     try:
@@ -766,7 +427,7 @@ def fetch_cat_page(url, driver):
     wait = WebDriverWait(driver, 50)
     try:
         wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "div.footer__inner")))
-        time.sleep(2)
+        wait_for(driver, page_settled())
         return driver.page_source
     except Exception as e:
         print(f"Error fetching URL")
@@ -776,7 +437,7 @@ def fetch_cat_page(url, driver):
 def fetch_item_page(url, driver):
     try:
         driver.get(url)
-        time.sleep(2)
+        wait_for(driver, EC.presence_of_element_located((By.CSS_SELECTOR, ITEM)))
         prev_last_product_link = ''
         while True:
             try:
@@ -787,9 +448,14 @@ def fetch_item_page(url, driver):
                 
                 print(f'prev: {prev_last_product_link}')
                 print(f'current: {last_product[-1]}')
-                time.sleep(2)
+                since = activity_mark(driver)
                 driver.execute_script("arguments[0].scrollIntoView(true);", last_product[-1])
-                time.sleep(2)
+                # Either the next page of products shows up or the lazy load request settles
+                wait_for(driver, EC.any_of(
+                    element_count_above((By.CSS_SELECTOR, ITEM), len(last_product)),
+                    network_idle(since=since)
+                ))
+                wait_for(driver, dom_settled(since=since))
                 prev_last_product_link = last_product[-1]
 
                 
@@ -829,6 +495,150 @@ def fetch_page(url, driver):
             print(f"An unexpected error occurred: {e}")
             return None
 
+def discover_products(pages, discover_page, workers=DISCOVERY_WORKERS):
+    """
+    Runs discover_page(page, driver) for every listing page on its own
+    DriverPool and yields (page, elements) as each page finishes, so the
+    products of the first categories can be scraped while the rest load.
+    """
+    workers = max(1, min(workers, len(pages)))
+    pool = DriverPool(workers, name='discovery')
+
+    def run(page):
+        slot = pool.acquire()
+        try:
+            return page, discover_page(page, slot.get())
+        except Exception as e:
+            print(f"Error discovering {page}: {e}")
+            return page, []
+        finally:
+            pool.release(slot)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(run, page) for page in pages]
+            for future in as_completed(futures):
+                yield future.result()
+    finally:
+        pool.close()
+
+# Parse single product data
+def parse_product(doc, page, url):
+    data_bl = doc.find(PRODUCT_BLOCK)
+    if data_bl is not None:
+
+        name_el = doc.find(PRODUCT_NAME, data_bl)
+        if name_el is not None: # Get product name and parse SKU
+            name = doc.text(name_el).strip()
+            brand = doc.text(doc.find(PRODUCT_BRAND, data_bl)).strip()
+        else:
+            name = "N/A"
+            brand = "N/A"
+
+        image_element = doc.find_all(PRODUCT_IMAGE) # Get product image URL
+        img_list = []
+        for a in image_element:
+            link = None
+            img_url_el = doc.find(FIRST_IMG, a)
+            img_url_list = doc.attr(img_url_el, "data-srcset")
+            if img_url_list:
+                sources = img_url_list.split(',')
+                for source in sources:
+                    parts = source.strip().split()
+                    if len(parts) == 2:
+                        url, descriptor = parts
+                        if descriptor == '600w':
+                            link = url
+                            break # Found the link, no need to continue
+            img_list.append(link)
+        v = [item for item in img_list if item is not None]    
+        image_url = ','.join(v) if img_list else "N/A"
+
+        ld_json_script = doc.find_all(LD_JSON)
+        sku = None
+        if ld_json_script:
+            for a in ld_json_script:
+                try:
+                    script_content = doc.string(a)
+                    product_data = json.loads(script_content)
+                    sku = product_data.get('sku')
+                except Exception as e:
+                    print(f"An unexpected error occurred: {e}")
+
+        desc = []
+        desc_el = doc.find(PRODUCT_DESC, data_bl) # Get product description
+        desc.append(doc.markup(desc_el) if desc_el is not None else "N/A")
+
+        cat = []
+        cat_bl = doc.find(SIDE_MENU)
+        if cat_bl is not None:
+            cat.append([doc.text(a).strip() for a in doc.find_all(ACTIVE_LINKS, cat_bl)])
+        else:
+            cat.append("N/A")
+
+        price_bl = doc.find(PRICE_BLOCK, data_bl)
+        if price_bl is not None:
+            price_el = doc.find(PRICE, price_bl)
+            price = doc.text(price_el).strip() if price_el is not None else "N/A"
+            compare_el = doc.find(COMPARE_PRICE, price_bl)
+            compare_at_price = doc.text(compare_el).strip() if compare_el is not None else "N/A"
+        else:
+            price = "N/A"
+            compare_at_price = "N/A"
+
+        video_bl = doc.find(VIDEO_BLOCK, data_bl)
+        if video_bl is not None:
+            desc.append(doc.markup(video_bl))
+        upc_bl = doc.find(UPC_BLOCK)
+        if upc_bl is not None:
+            upc = doc.text(doc.find(UPC, upc_bl)).strip()
+        else:
+            upc = ''
+
+        vendor = doc.text(doc.find(VENDOR)).strip()
+
+
+
+
+        handle = create_url_handle(name, sku)
+        return { # Add product data as a single row
+            "cat": page,
+            "url": url,
+            "brand": brand,
+            "category": cat,
+            "Title": name,
+            "Variant SKU" : sku,
+            "Image Src": image_url,
+            "Body (HTML)": desc,
+            'Variant Barcode': upc,
+            'Variant Price': price,
+            'Variant Compare At Price': compare_at_price,
+            'Vendor': vendor,
+            'Handle': handle,
+            'debug_1': 'Matt and Max'
+
+        }
+    else:
+        return { # Add product data as a single row
+            "cat": page,
+            "url": url,
+            "brand": '',
+            "category": '',
+            "Title": '',
+            "Variant SKU" : '',
+            "Image Src": '',
+            "Body (HTML)": '',
+            'Variant Barcode': '',
+            'Variant Price': '',
+            'Variant Compare At Price': '',
+            'Vendor': 'Matt and Max',
+            'Handle': ''
+        }
+
+def parse_product_page(element, html):
+    """Parses a fetched product page into the product dict. Plain data in and out, so it can run in a parse worker process."""
+    return parse_product(parse_html(html), element['cat'], element['url'])
+
 def scrape_products_all():
     products = []
 
@@ -836,170 +646,66 @@ def scrape_products_all():
     def fetch_page(url, driver):
         try:
             driver.get(url)
-            time.sleep(2)
+            wait_for(driver, page_settled())
             return driver.page_source
         except:
             print("Error fetching")
             return None
 
-    # Create product URL list
-    def get_product_urls():
+    # Load a listing page with all of its products shown, returns the product elements
+    def discover_page(page, driver):
+        html = fetch_page(page, driver)
+        try:
+            view_all_but = WebDriverWait(driver, 1).until(
+            EC.presence_of_element_located((By.CSS_SELECTOR, "div.hidden.sm\\:flex.border-l.border-gray-2.px-2.lg\\:px-4.flex.items-center"))
+            )
+            if view_all_but:
+                shown = len(driver.find_elements(By.CSS_SELECTOR, ITEM))
+                since = activity_mark(driver)
+                view_all_but.click()
+                wait_for(driver, EC.any_of(element_count_above((By.CSS_SELECTOR, ITEM), shown), network_idle(since=since)))
+                wait_for(driver, page_settled(since=since))
+        except:
+            print("No view all button")
+            pass
+        html = driver.page_source
+        soup = bs(html, "lxml") if html else print("No page source HTML")
+        return [{'cat': page, 'url': product.select_one("a").get('href')} for product in soup.select(ITEM)]
+
+    # Product URLs of all categories, streamed to the crawl as each category page is done
+    def get_product_urls(urls_stats):
         pages = [URL_1, URL_2, URL_3, URL_4, URL_5, URL_6, URL_7, URL_8, URL_9, URL_10, URL_11, URL_12, URL_13, URL_14, URL_15, URL_16, URL_17, URL_18, URL_19, URL_20, URL_21, URL_22, URL_23, URL_24, URL_25, URL_26, URL_27, URL_28, URL_29, URL_30, URL_31, URL_32, URL_33, URL_34, URL_35, URL_36, URL_37, URL_38, URL_39, URL_40, URL_41, URL_42, URL_43, URL_44, URL_45, URL_46, URL_47]
-        product_urls = []
-        url_to_save = []
-        urls_stats = []
-        for page in pages:
-            url = page
-            html = fetch_page(url, driver)
-            try:
-                view_all_but = WebDriverWait(driver, 1).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div.hidden.sm\\:flex.border-l.border-gray-2.px-2.lg\\:px-4.flex.items-center"))
-                )
-                if view_all_but:
-                    view_all_but.click()
-                time.sleep(2)
-            except:
-                print("No view all button")
-                pass
-            html = driver.page_source
-            soup = bs(html, "lxml") if html else print("No page source HTML")
-            product_elements = soup.select(ITEM)
-            for product in product_elements:
-                product_page_element = product.select_one("a").get('href')
-                product_urls.append({'cat': page, 'url': product_page_element})
-                url_to_save.append({'cat': page, 'url': product_page_element})
-                urls_stats.append({'cat': page, 'url': product_page_element})
-            
+        journal.start()
+        for page, url_to_save in discover_products(pages, discover_page):
             print(f'Found {len(url_to_save)} products on {page}')
             url_to_csv(url_to_save)
-            url_to_save = []
-        return product_urls, urls_stats
+            urls_stats.extend(url_to_save)
+            journal.add(url_to_save)
+            yield from url_to_save
+        journal.discovered()
 
-    # Parse single product data
-    def parse_product(prod_soup, page, url):
-            if prod_soup.select_one("div.flex-1.min-w-0.min-h-0.overflow-x-hidden"):
-                data_bl = prod_soup.select_one("div.flex-1.min-w-0.min-h-0.overflow-x-hidden")
-                
-                if data_bl.select_one(NAME): # Get product name and parse SKU
-                    name = data_bl.select_one(NAME).text.strip()
-                    brand = data_bl.select_one("h2").text.strip()  
-                else:
-                    name = "N/A"
-                    brand = "N/A"
-
-                image_element = prod_soup.select(IMAGE) # Get product image URL
-                img_list = []
-                for a in image_element:
-                    link = None
-                    img_url_el = a.select_one("img")
-                    img_url_list = img_url_el.get("data-srcset")
-                    if img_url_list:
-                        sources = img_url_list.split(',')
-                        for source in sources:
-                            parts = source.strip().split()
-                            if len(parts) == 2:
-                                url, descriptor = parts
-                                if descriptor == '600w':
-                                    link = url
-                                    break # Found the link, no need to continue
-                    img_list.append(link)
-                v = [item for item in img_list if item is not None]    
-                image_url = ','.join(v) if img_list else "N/A"
-                
-                ld_json_script = prod_soup.select('script[type="application/ld+json"]')
-                sku = None
-                if ld_json_script:
-                    for a in ld_json_script:
-                        try:
-                            script_content = a.string
-                            product_data = json.loads(script_content)
-                            sku = product_data.get('sku')
-                        except Exception as e:
-                            print(f"An unexpected error occurred: {e}")
-
-                desc = []
-                desc_el = data_bl.select_one(str(DESC)) if data_bl.select(DESC) else "N/A" # Get product description
-                desc.append(desc_el)
-
-                cat = []
-                cat_bl = prod_soup.select_one("ul.side-menu")
-                if cat_bl:
-                    cat.append([a.text.strip() for a in cat_bl.select("a.active")])
-                else:
-                    cat.append("N/A")
-                
-                price_bl = data_bl.select_one("div.font-body.tracking-normal.antialiased.mt-2")
-                if price_bl:
-                    price = price_bl.select_one("span").text.strip() if price_bl.select_one("span") else "N/A"
-                    compare_at_price = price_bl.select_one("del").text.strip() if price_bl.select_one("del") else "N/A"  
-                else:
-                    price = "N/A"
-                    compare_at_price = "N/A"
-            
-                if data_bl.select("div[class='md:mr-8']"):
-                    video_bl = data_bl.select_one("div[class='md:mr-8']")
-                    desc.append(video_bl)
-                upc_bl = prod_soup.select('div[class="font-navigation uppercase tracking-tight sm:tracking-widest mt-2 mb-4 text-2xs sm:text-xs md:text-3xs xl:text-sm"]')
-                if upc_bl:
-                    upc = upc_bl[0].select_one('div').text.strip()
-                else:
-                    upc = ''
-
-                vendor = prod_soup.select_one('h2[class="font-navigation uppercase font-bold text-xl sm:text-2xl md:text-xl xl:text-2xl tracking-widest leading-tight"]').text.strip()
-                
-
-                    
-                
-                handle = create_url_handle(name, sku)
-                return { # Add product data as a single row
-                    "cat": page,
-                    "url": url,
-                    "brand": brand,
-                    "category": cat,
-                    "Title": name,
-                    "Variant SKU" : sku,
-                    "Image Src": image_url,
-                    "Body (HTML)": desc,
-                    'Variant Barcode': upc,
-                    'Variant Price': price,
-                    'Variant Compare At Price': compare_at_price,
-                    'Vendor': vendor,
-                    'Handle': handle,
-                    'debug_1': 'Matt and Max'
-
-                }
-            else:
-                return { # Add product data as a single row
-                    "cat": page,
-                    "url": url,
-                    "brand": '',
-                    "category": '',
-                    "Title": '',
-                    "Variant SKU" : '',
-                    "Image Src": '',
-                    "Body (HTML)": '',
-                    'Variant Barcode': '',
-                    'Variant Price': '',
-                    'Variant Compare At Price': '',
-                    'Vendor': 'Matt and Max',
-                    'Handle': ''
-                }
-    driver = setup_driver()
     url_count = 0
     product_count = 0
+    unchanged_count = 0
     stats = []
     prod_stats = []
     # open(PROD_DEBUG_FILE, 'w', encoding='utf-8').close()
 
-
-    product_urls, urls_stats = get_product_urls()
+    journal = CrawlJournal(JOURNAL_FILE)
+    if journal.unfinished():
+        product_urls = journal.remaining()
+        urls_stats = []
+        print(f"Resuming interrupted run, {len(product_urls)} products left")
+    else:
+        urls_stats = []
+        product_urls = get_product_urls(urls_stats)
 
     conn = None
     try:
         # 1. Establish the database connection
         conn = psycopg2.connect(**DB_CONFIG)
         conn.autocommit = False  # Start a transaction
-        cursor = conn.cursor()
+        writer = MattAndMaxWriter(conn, VENDOR_COLUMN, VENDOR_VALUE)
         
     except (Exception, psycopg2.Error) as error:
         print(f"Database Error: {error}", file=sys.stderr)
@@ -1008,38 +714,117 @@ def scrape_products_all():
         sys.exit(1)
     
 
-    # Parse product page
-    for element in product_urls:
-        cat = element['cat']
+    # Fetch and parse a single product page on one of the pool workers
+    def scrape_product(element, get_driver):
         url = element['url']
         print(f'Parsing product {url}')
-            
-        prod_html = fetch_page(url, driver)
-        if prod_html:
-            prod_soup = bs(prod_html, "lxml")
-        if prod_soup:
-            product = parse_product(prod_soup, cat, url)
-        
+        prod_html = fetch_page_http(url, STATIC_PAGE_MARKERS, validators=journal.validators(element)) if FETCH_MODE == 'http' else None
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html:
+            prod_html = fetch_page(url, get_driver())
+        if not prod_html:
+            return None
+        journal.fetched(element, prod_html)
+        product = submit_parse(parse_product_page, element, prod_html).result()
+        journal.mark([element], 'parsed')
+        return product
 
+    # Same as scrape_product for the async crawler; returns None to send the page to Chrome
+    async def scrape_product_async(element, fetch):
+        url = element['url']
+        print(f'Parsing product {url}')
+        prod_html = await fetch(url, journal.validators(element))
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html or not all(marker in prod_html for marker in STATIC_PAGE_MARKERS):
+            return None
+        journal.fetched(element, prod_html)
+        if PARSE_PROCESSES:
+            product = await asyncio.wrap_future(get_parse_pool().submit(parse_product_page, element, prod_html))
         else:
-            debug_message = f"Product {url} from {cat} is empty\n"
-            print(f"WARNING: {debug_message.strip()}")
-            with open(PROD_DEBUG_FILE, 'a', encoding='utf-8') as prod_debug_file:
-                prod_debug_file.write(debug_message)
-            continue
-
-        if not product:
-            continue 
-        
-        
-        if product and product['Title']:
-            
-            db_status, product_id = upsert_product_data(product, [], cursor)
-            conn.commit()
-        
+            product = await asyncio.to_thread(parse_product_page, element, prod_html)
+        journal.mark([element], 'parsed')
+        return product
+
+    # Pipeline stages, each takes the previous stage's payload and passes on
+    # what it does not handle (NOT_MODIFIED, None) untouched
+    drivers = None
+
+    def fetch_stage(element, _):
+        url = element['url']
+        print(f'Fetching product {url}')
+        prod_html = fetch_page_http(url, STATIC_PAGE_MARKERS, validators=journal.validators(element)) if FETCH_MODE == 'http' else None
+        if prod_html is NOT_MODIFIED:
+            return NOT_MODIFIED
+        if not prod_html:
+            prod_html = drivers.run(lambda get_driver: fetch_page(url, get_driver()), url)
+        if prod_html:
+            journal.fetched(element, prod_html)
+        return prod_html or None
+
+    def parse_stage(element, prod_html):
+        if not isinstance(prod_html, str):
+            return prod_html
+        product = get_parse_pool().submit(parse_product_page, element, prod_html).result()
+        journal.mark([element], 'parsed')
+        return product
+
+    # Parse product page
+    if CRAWL_MODE == 'async':
+        crawled = crawl_products_async(product_urls, scrape_product_async, scrape_product)
+    elif CRAWL_MODE == 'pipeline':
+        # Chrome only fetches what plain HTTP could not, so the pool stays at DRIVER_WORKERS
+        drivers = DriverPool(DRIVER_WORKERS)
+        crawled = crawl_pipeline(product_urls, [
+            ('fetch', fetch_stage, FETCH_WORKERS),
+            ('parse', parse_stage, PARSE_WORKERS),
+        ])
+    else:
+        crawled = crawl_products(product_urls, scrape_product)
+
+    def record(results):
+        nonlocal product_count, unchanged_count
+        for element, db_status, product_id in results:
+            if db_status == UNCHANGED_STATUS:
+                unchanged_count += 1
+                continue
             product_count += 1
-            prod_stats.append({'url': url, 'status': db_status, 'product_id': product_id, 'product_count': product_count})
-    
+            prod_stats.append({'url': element['url'], 'status': db_status, 'product_id': product_id, 'product_count': product_count})
+        journal.mark([element for element, db_status, _ in results if db_status == UNCHANGED_STATUS], 'unchanged')
+        journal.mark([element for element, db_status, _ in results if db_status and db_status != UNCHANGED_STATUS], 'upserted')
+        journal.mark([element for element, db_status, _ in results if not db_status], 'skipped')
+
+    # Closing the crawl stops its threads if the loop ends early
+    with closing(crawled):
+        for element, product in crawled:
+            cat = element['cat']
+            url = element['url']
+            if product is None:
+                debug_message = f"Product {url} from {cat} is empty\n"
+                print(f"WARNING: {debug_message.strip()}")
+                with open(PROD_DEBUG_FILE, 'a', encoding='utf-8') as prod_debug_file:
+                    prod_debug_file.write(debug_message)
+                continue
+
+            # The fields hash is always computed so the next incremental run has one to compare with
+            # Unchanged products are not written again, only marked as seen in the DB
+            if product is NOT_MODIFIED or (journal.unchanged(element, product) and INCREMENTAL):
+                record(writer.add_unchanged(element))
+                continue
+
+            if not product or not product['Title']:
+                journal.mark([element], 'skipped')
+                continue
+
+            record(writer.add(element, product, []))
+
+    record(writer.close())
+    if drivers is not None:
+        drivers.close()
+    journal.finish()
+    if INCREMENTAL:
+        print(f"{unchanged_count} products unchanged since the last run")
     debug(urls_stats, prod_stats)
     stats.append({
         'product_count': product_count,
@@ -1050,7 +835,6 @@ def scrape_products_all():
     prod_stats_df = pd.DataFrame(prod_stats)
     prod_stats_df.to_csv('../data/matt_and_max_prod_stats.csv', index=False)
 
-    driver.quit()
     if conn:
         conn.close()
         print("Database connection closed.")
@@ -0,0 +1,38 @@
+import importlib.util
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+PROJECTS = ['kbeauty', 'matt_and_max']
+
+# The scrapers import the shared crawl module from common/ the same way
+sys.path.insert(0, str(ROOT / 'common'))
+
+
+def load_script(project, name):
+    """
+    Imports <project>/scripts/<name>.py as <project>_<name>. The scripts
+    resolve ../data and ../archive from the working directory, so the
+    import runs from their scripts folder like main.sh does.
+    """
+    module_name = f"{project}_{name}"
+    if module_name not in sys.modules:
+        scripts = ROOT / project / 'scripts'
+        spec = importlib.util.spec_from_file_location(module_name, scripts / f"{name}.py")
+        module = importlib.util.module_from_spec(spec)
+        cwd = os.getcwd()
+        os.chdir(scripts)
+        try:
+            spec.loader.exec_module(module)
+        finally:
+            os.chdir(cwd)
+        sys.modules[module_name] = module
+    return sys.modules[module_name]
+
+
+@pytest.fixture(params=PROJECTS)
+def export(request):
+    return load_script(request.param, 'export')
@@ -0,0 +1,238 @@
+import itertools
+
+import crawl_common
+import pandas as pd
+import pytest
+
+COUNTS = [0, 1, 3]
+
+
+def product_rows(product, images, variants):
+    handle = f"product_{product}"
+    rows = [{
+        'Handle': handle, 'Title': f"Product {product}", 'Variant SKU': f"SKU{product}",
+        'Image Src': ", ".join(f"https://cdn.example.com/p{product}_{n}.jpg?width=1000" for n in range(images)),
+        'Variant Price': '12.00', 'Inventory quantity': 10, 'cat_name': 'Serums'
+    }]
+    for n in range(variants):
+        rows.append({'Handle': handle, 'Variant SKU': f"SKU{product}-{n}", 'Image Src': None,
+                     'Variant Price': f"{10 + n}.00", 'Variant Barcode': f"88{product}{n}",
+                     'Inventory quantity': 10})
+    return rows
+
+
+def build_frame(export, shapes):
+    """Export frame of one product per (images, variants) shape, each followed by its variant rows."""
+    rows = [row for product, (images, variants) in enumerate(shapes) for row in product_rows(product, images, variants)]
+    return pd.DataFrame(rows).reindex(columns=export.FINAL_COLUMNS)
+
+
+SHAPES = list(itertools.product(COUNTS, COUNTS))
+# Every shape on its own, then all of them in one frame with the handles out of order
+FRAMES = [[shape] for shape in SHAPES] + [SHAPES[::-1]]
+FRAME_IDS = [f"{images}img-{variants}var" for images, variants in SHAPES] + ['mixed']
+
+
+def expand_image_rows_loop(df):
+    # The iterrows() version process_and_save_data used before expand_image_rows
+    expanded_rows = []
+    for index, row in df.iterrows():
+        urls_str = str(row['Image Src'])
+        urls = [url.strip() for url in urls_str.split(',') if url.strip()]
+        current_url_handle = row['Handle']
+
+        if not urls:
+            expanded_rows.append(row.to_dict())
+            continue
+
+        first_url_row = row.copy()
+        first_url_row['Image Src'] = urls[0]
+        expanded_rows.append(first_url_row.to_dict())
+
+        for i in range(1, len(urls)):
+            new_row_data = {col: None for col in df.columns}
+            new_row_data['Image Src'] = urls[i]
+            new_row_data['Handle'] = current_url_handle
+            expanded_rows.append(new_row_data)
+    return pd.DataFrame(expanded_rows)
+
+
+def merge_single_variants_loop(export, df):
+    # The per-handle loop process_and_save_data used before merge_single_variants
+    processed_rows = []
+    for handle, group in df.groupby('Handle'):
+        product_rows = group[group['Title'].notna()]
+        variant_rows = group[group['Variant SKU'].notna() & group['Title'].isna()]
+        main_product_row_idx = product_rows.index[0] if not product_rows.empty else None
+
+        if len(variant_rows) == 1 and main_product_row_idx is not None:
+            variant_row_idx = variant_rows.index[0]
+            variant_data = df.loc[variant_row_idx, export.VARIANT_COLS_TO_MERGE].to_dict()
+            product_row_dict = df.loc[main_product_row_idx].to_dict()
+            for col, value in variant_data.items():
+                if pd.notna(value):
+                    product_row_dict[col] = value
+            processed_rows.append(product_row_dict)
+            auxiliary_rows_df = group.drop(index=[main_product_row_idx, variant_row_idx], errors='ignore')
+            for _, aux_row in auxiliary_rows_df.iterrows():
+                processed_rows.append(aux_row.to_dict())
+        else:
+            for idx in group.index:
+                processed_rows.append(df.loc[idx].to_dict())
+    return pd.DataFrame(processed_rows).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('shapes', FRAMES, ids=FRAME_IDS)
+def test_expand_image_rows_matches_loop(export, shapes):
+    df = build_frame(export, shapes)
+    expected = expand_image_rows_loop(df)
+    assert export.expand_image_rows(df).to_csv(index=False) == expected.to_csv(index=False)
+
+
+@pytest.mark.parametrize('shapes', FRAMES, ids=FRAME_IDS)
+def test_merge_single_variants_matches_loop(export, shapes):
+    df = export.expand_image_rows(build_frame(export, shapes))
+    expected = merge_single_variants_loop(export, df)
+    assert export.merge_single_variants(df).to_csv(index=False) == expected.to_csv(index=False)
+
+
+@pytest.mark.parametrize('images, variants', SHAPES)
+def test_export_rows_per_product(export, images, variants):
+    df = export.merge_single_variants(export.expand_image_rows(build_frame(export, [(images, variants)])))
+    # One row per image (at least one), the variant rows, and a single variant folded into the product row
+    assert len(df) == max(images, 1) + (0 if variants == 1 else variants)
+    product = df.iloc[0]
+    assert product['Title'] == "Product 0"
+    assert product['Variant SKU'] == ("SKU0-0" if variants == 1 else "SKU0")
+    extra_images = df[df['Title'].isna() & df['Variant SKU'].isna()]
+    assert len(extra_images) == max(images - 1, 0)
+    assert extra_images.drop(columns=['Handle', 'Image Src']).isna().all().all()
+
+
+def db_product(export, product, variant_statuses, handle=None):
+    """(parent_row, variant_rows) of a product as iter_export_products yields it."""
+    handle = handle or f"product_{product}"
+    images = ", ".join(f"https://cdn.example.com/p{product}_{n}.jpg" for n in range(1 + product % 3))
+    parent = {col: None for col in export.PRODUCT_EXPORT_COLUMNS}
+    parent.update(product_id=product, url=f"https://example.com/p{product}", cat_name='Serums',
+                  title=f"Product {product}", sku=f"SKU{product}", image_url=images, handle=handle,
+                  vendor='Vendor', debug_1='Vendor')
+    variants = []
+    for n, status in enumerate(variant_statuses):
+        variant = {col: None for col in export.VARIANT_EXPORT_COLUMNS}
+        variant.update(var_id=f"SKU{product}-{n}", product_id=product, handle=handle, sku=f"SKU{product}-{n}",
+                       price=f"{10 + n}.00", upc=f"UPC 88{product}{n}", status_int=status)
+        variants.append(variant)
+    return parent, variants
+
+
+def db_products(export):
+    """
+    Products with 0, 1 and several variants, all new, all known, updated,
+    and with variants of mixed statuses split across the output files.
+    """
+    statuses = [['NEW'], ['UPD', 'EXIST'], ['EXIST'], ['NEW', 'NEW', 'NEW'], ['UPD'], ['NOT_READY', 'UPD'],
+                ['EXIST', 'EXIST', 'NOT_READY'], ['NEW'], ['UPD', 'UPD', 'UPD', 'UPD'], ['EXIST']]
+    return [db_product(export, product, variant_statuses, f"product_{9 - product}")
+            for product, variant_statuses in enumerate(statuses)]
+
+
+def run_export(export, directory, batch_size):
+    directory.mkdir()
+    separated_data = {status: export.ExportFile(str(directory / f"{status}.csv")) for status in ('UPD', 'NEW')}
+    draft_data = export.ExportFile(str(directory / "to_draft.csv"))
+    archive = export.ExportFile(str(directory / "archive.csv"))
+    batches = []
+    count = export.export_products(db_products(export), separated_data, draft_data, archive,
+                                   batches.append, batch_size=batch_size)
+    return count, batches
+
+
+def test_batched_export_matches_single_write(export, tmp_path):
+    single_counts, single_batches = run_export(export, tmp_path / 'single', 10 ** 6)
+    batched_counts, batched_batches = run_export(export, tmp_path / 'batched', 1)
+    assert single_counts == batched_counts
+    assert len(single_batches) == 1 and len(batched_batches) > 2
+    assert sorted(sum(single_batches, [])) == sorted(sum(batched_batches, []))
+
+    for name in ('UPD.csv', 'NEW.csv', 'to_draft.csv', 'archive.csv'):
+        single = (tmp_path / 'single' / name).read_bytes()
+        assert single
+        assert (tmp_path / 'batched' / name).read_bytes() == single
+        handles = pd.read_csv(tmp_path / 'batched' / name)['Handle']
+        assert handles.is_monotonic_increasing
+    assert sorted(path.name for path in (tmp_path / 'batched').iterdir()) == ['NEW.csv', 'UPD.csv', 'archive.csv',
+                                                                         'to_draft.csv']
+
+
+def crawl(db, written, unchanged):
+    """
+    Status changes of one crawl in db ({product: [variant statuses]}), as
+    ProductWriter makes them: written products are UPD if already stored,
+    NEW otherwise, products found unchanged go through
+    UNCHANGED_TRANSITIONS and the products not seen keep their status.
+    """
+    for product in written:
+        db[product] = ['UPD' if product in db else 'NEW'] * 2
+    for product in unchanged:
+        db[product] = [crawl_common.UNCHANGED_TRANSITIONS.get(status, status) for status in db[product]]
+
+
+def export_run(export, db, directory):
+    """
+    One export of db, as export_and_manage_data runs it: the variants of
+    TARGET_STATUSES are exported, then go through STATUS_TRANSITIONS, and
+    UNCHANGED variants go back to EXIST. Returns the products in each file.
+    """
+    directory.mkdir()
+    separated_data = {status: export.ExportFile(str(directory / f"{status}.csv")) for status in ('UPD', 'NEW')}
+    draft_data = export.ExportFile(str(directory / "to_draft.csv"))
+    archive = export.ExportFile(str(directory / "archive.csv"))
+    products = []
+    for product, statuses in sorted(db.items()):
+        parent, variants = db_product(export, product, statuses)
+        variants = [variant for variant in variants if variant['status_int'] in export.TARGET_STATUSES]
+        if variants:
+            products.append((parent, variants))
+    exported = []
+    export.export_products(products, separated_data, draft_data, archive, exported.extend)
+
+    for var_id, status in exported:
+        product, n = (int(part) for part in var_id[len("SKU"):].split('-'))
+        if db[product][n] == status and status in export.STATUS_TRANSITIONS:
+            db[product][n] = export.STATUS_TRANSITIONS[status]
+    for statuses in db.values():
+        statuses[:] = ['EXIST' if status == export.UNCHANGED_STATUS else status for status in statuses]
+
+    files = {}
+    for name in ('UPD', 'NEW', 'to_draft'):
+        path = directory / f"{name}.csv"
+        titles = pd.read_csv(path)['Title'].dropna() if path.exists() else []
+        files[name] = {int(title[len("Product "):]) for title in titles}
+    return files
+
+
+def test_incremental_crawl_export_cycle(export, tmp_path):
+    assert export.UNCHANGED_STATUS == crawl_common.UNCHANGED_STATUS
+    assert export.UNCHANGED_STATUS not in export.TARGET_STATUSES
+    db = {}
+
+    # Full crawl: everything is new and exported once
+    crawl(db, written=[0, 1, 2], unchanged=[])
+    files = export_run(export, db, tmp_path / 'export_1')
+    assert files == {'UPD': set(), 'NEW': {0, 1, 2}, 'to_draft': set()}
+    assert db == {0: ['EXIST'] * 2, 1: ['EXIST'] * 2, 2: ['EXIST'] * 2}
+
+    # Incremental crawl: 0 changed, 1 unchanged, 2 gone from the site.
+    # Only the product that was not seen is drafted
+    crawl(db, written=[0], unchanged=[1])
+    assert db[1] == ['UNCHANGED'] * 2
+    files = export_run(export, db, tmp_path / 'export_2')
+    assert files == {'UPD': {0}, 'NEW': set(), 'to_draft': {2}}
+    assert db == {0: ['EXIST'] * 2, 1: ['EXIST'] * 2, 2: ['NOT_READY'] * 2}
+
+    # 1 unchanged again, 2 back on the site unchanged, 0 not seen
+    crawl(db, written=[], unchanged=[1, 2])
+    files = export_run(export, db, tmp_path / 'export_3')
+    assert files == {'UPD': {2}, 'NEW': set(), 'to_draft': {0}}
+    assert db == {0: ['NOT_READY'] * 2, 1: ['EXIST'] * 2, 2: ['EXIST'] * 2}